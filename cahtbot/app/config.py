@@ -14,6 +14,9 @@ class Settings:
     DB_USER = os.getenv("NEON_DB_USER")
     DB_PASSWORD = os.getenv("NEON_DB_PASSWORD")
     DB_SSLMODE = os.getenv("NEON_DB_SSLMODE", "require")
+    DB_ASYNC_POOL_MIN = int(os.getenv("DB_ASYNC_POOL_MIN", "2"))
+    DB_ASYNC_POOL_MAX = int(os.getenv("DB_ASYNC_POOL_MAX", "20"))
+    DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
 
     # Models
     HF_API_TOKEN = os.getenv("HF_API_TOKEN")
@@ -21,9 +24,125 @@ class Settings:
     EMBED_MODEL_NAME = os.getenv(
         "EMBED_MODEL", "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
     )
+    # Embedding inference: "torch" (SentenceTransformer) or "onnx" (ONNX Runtime on
+    # CPU, exported with `python export_onnx.py` into EMBED_ONNX_DIR). With
+    # EMBED_ONNX_QUANTIZE the dynamically int8-quantized export is served.
+    EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+    EMBED_ONNX_DIR = os.getenv("EMBED_ONNX_DIR", "models/onnx")
+    EMBED_ONNX_QUANTIZE = os.getenv("EMBED_ONNX_QUANTIZE", "true").lower() in ("1", "true", "yes")
+    # Pinned local model snapshots (`python download_model.py`); a snapshot in
+    # EMBED_MODEL_DIR is loaded instead of the hub. EMBED_MODEL_REVISION pins the
+    # hub commit, EMBED_MODEL_OFFLINE forbids any hub access when loading.
+    EMBED_MODEL_DIR = os.getenv("EMBED_MODEL_DIR", "models/snapshots")
+    EMBED_MODEL_REVISION = os.getenv("EMBED_MODEL_REVISION") or None
+    EMBED_MODEL_OFFLINE = os.getenv("EMBED_MODEL_OFFLINE", "false").lower() in ("1", "true", "yes")
+    # Seconds a request waits for the model still loading at startup before it
+    # is answered without retrieved context
+    EMBED_READY_TIMEOUT = float(os.getenv("EMBED_READY_TIMEOUT", "5"))
+    # Backoff between attempts after a failed model load (seconds, doubling up to the max)
+    EMBED_LOAD_RETRY_SECONDS = float(os.getenv("EMBED_LOAD_RETRY_SECONDS", "5"))
+    EMBED_LOAD_RETRY_MAX_SECONDS = float(os.getenv("EMBED_LOAD_RETRY_MAX_SECONDS", "300"))
+    # Query embedding cache (entries, seconds)
+    QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+    QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+    # Semantic answer cache for history-free questions (0 entries disables it)
+    ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+    ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "1800"))
+    ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+    # Indexing: chunks per encode() call and encoder processes (1 = in-process)
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+    EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+    # Rows per COPY/INSERT transaction when writing documents_embeddings
+    EMBED_WRITE_BATCH_SIZE = int(os.getenv("EMBED_WRITE_BATCH_SIZE", "500"))
+    # nice value of the background re-index worker thread (higher = lower priority)
+    REINDEX_NICENESS = int(os.getenv("REINDEX_NICENESS", "10"))
+    # Embedding executor: threads running encode() and the bound on waiting
+    # requests (online queries fail fast when it is full; re-index batches wait)
+    EMBED_EXECUTOR_THREADS = int(os.getenv("EMBED_EXECUTOR_THREADS", "1"))
+    EMBED_QUEUE_SIZE = int(os.getenv("EMBED_QUEUE_SIZE", "256"))
+    # Micro-batching of concurrent online queries: how long the executor waits
+    # for more queries after the first, and the most texts per encode call
+    # (EMBED_MICROBATCH_MAX_SIZE=1 disables it)
+    EMBED_MICROBATCH_MAX_WAIT_MS = float(os.getenv("EMBED_MICROBATCH_MAX_WAIT_MS", "2"))
+    EMBED_MICROBATCH_MAX_SIZE = int(os.getenv("EMBED_MICROBATCH_MAX_SIZE", "32"))
+
+    # pgvector ANN index on documents_embeddings: "hnsw", "ivfflat" or "none"
+    # (exact scan). Build options apply on (re)build; search options per query.
+    # VECTOR_IVFFLAT_LISTS=0 sizes the lists from the row count.
+    # See benchmarks/bench_vector_index.py for the recall/latency trade-off.
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")
+    VECTOR_HNSW_M = int(os.getenv("VECTOR_HNSW_M", "16"))
+    VECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTOR_HNSW_EF_CONSTRUCTION", "64"))
+    VECTOR_HNSW_EF_SEARCH = int(os.getenv("VECTOR_HNSW_EF_SEARCH", "40"))
+    VECTOR_IVFFLAT_LISTS = int(os.getenv("VECTOR_IVFFLAT_LISTS", "0"))
+    VECTOR_IVFFLAT_PROBES = int(os.getenv("VECTOR_IVFFLAT_PROBES", "10"))
+    VECTOR_INDEX_BUILD_MEMORY = os.getenv("VECTOR_INDEX_BUILD_MEMORY", "256MB")
+
+    # Retrieval backend: "pgvector" (search in Postgres) or "memory" (all vectors
+    # held in process as a NumPy matrix, reloaded after a re-index; other
+    # workers notice changes every MEMORY_INDEX_REFRESH_INTERVAL seconds, 0 = never).
+    # MEMORY_INDEX_FLOAT16 halves the matrix memory at the cost of slower searches.
+    RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")
+    MEMORY_INDEX_FLOAT16 = os.getenv("MEMORY_INDEX_FLOAT16", "false").lower() in ("1", "true", "yes")
+    MEMORY_INDEX_REFRESH_INTERVAL = float(os.getenv("MEMORY_INDEX_REFRESH_INTERVAL", "60"))
+
+    # Hybrid retrieval (pgvector backend): fuse vector and lexical (full-text +
+    # trigram) rankings of HYBRID_CANDIDATES rows each by reciprocal rank,
+    # score = sum(1 / (HYBRID_RRF_K + rank)). Requires migration 004; off by
+    # default, and without the migration vector search is used either way.
+    RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "false").lower() in ("1", "true", "yes")
+    HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "50"))
+    HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+    # ANN over-fetch factor for searches with prefilters, so that enough rows
+    # survive the WHERE clause
+    FILTERED_SEARCH_OVERFETCH = int(os.getenv("FILTERED_SEARCH_OVERFETCH", "4"))
+
+    # Prompt assembly: token budgets for the retrieved context and the chat
+    # history, the chars-per-token estimate, and the word-overlap (Jaccard)
+    # above which a context chunk counts as a duplicate of a better-ranked one
+    PROMPT_CONTEXT_TOKENS = int(os.getenv("PROMPT_CONTEXT_TOKENS", "2500"))
+    PROMPT_HISTORY_TOKENS = int(os.getenv("PROMPT_HISTORY_TOKENS", "1500"))
+    PROMPT_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "2.5"))
+    PROMPT_DEDUP_SIMILARITY = float(os.getenv("PROMPT_DEDUP_SIMILARITY", "0.85"))
+
+    # Upper bound on max_results in /chat, /chat/stream and POST /retrieve/batch
+    RETRIEVAL_MAX_RESULTS = int(os.getenv("RETRIEVAL_MAX_RESULTS", "50"))
+    # Upper bound on the number of queries accepted by POST /retrieve/batch
+    BATCH_RETRIEVAL_MAX_QUERIES = int(os.getenv("BATCH_RETRIEVAL_MAX_QUERIES", "32"))
 
     # API Keys
     GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+
+    # Write-behind persistence of chat messages
+    PERSIST_WRITE_BEHIND = os.getenv("PERSIST_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+    PERSIST_QUEUE_SIZE = int(os.getenv("PERSIST_QUEUE_SIZE", "1000"))
+    PERSIST_BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "100"))
+    PERSIST_FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.2"))
+    PERSIST_DRAIN_TIMEOUT = float(os.getenv("PERSIST_DRAIN_TIMEOUT", "10"))
+    PERSIST_MAX_RETRIES = int(os.getenv("PERSIST_MAX_RETRIES", "3"))
+
+    # Query rewriting for follow-up questions: "pipelined" (retrieve on the raw
+    # message while the rewrite runs) or "sequential"; timeout in seconds
+    QUERY_REWRITE_MODE = os.getenv("QUERY_REWRITE_MODE", "pipelined")
+    QUERY_REWRITE_TIMEOUT = float(os.getenv("QUERY_REWRITE_TIMEOUT", "1.5"))
+
+    # Hot cache of each user's conversation id and recent messages:
+    # "none" (default), "redis" (shared by all workers) or "memory" (single
+    # worker only: other workers would serve stale history)
+    CONVERSATION_CACHE_BACKEND = os.getenv("CONVERSATION_CACHE_BACKEND", "none")
+    # Worker processes (read by uvicorn and gunicorn as well)
+    WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    CONVERSATION_CACHE_TTL = float(os.getenv("CONVERSATION_CACHE_TTL", "1800"))
+    CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "10000"))
+    CONVERSATION_CACHE_MESSAGES = int(os.getenv("CONVERSATION_CACHE_MESSAGES", "10"))
+
+    # Groq HTTP client (shared for the application lifetime)
+    GROQ_TIMEOUT = float(os.getenv("GROQ_TIMEOUT", "30"))
+    GROQ_MAX_CONNECTIONS = int(os.getenv("GROQ_MAX_CONNECTIONS", "20"))
+    GROQ_MAX_KEEPALIVE = int(os.getenv("GROQ_MAX_KEEPALIVE", "10"))
+    GROQ_KEEPALIVE_EXPIRY = float(os.getenv("GROQ_KEEPALIVE_EXPIRY", "60"))
+    GROQ_HTTP2 = os.getenv("GROQ_HTTP2", "true").lower() in ("1", "true", "yes")
     
     def validate(self):
         """Validate all required environment variables"""
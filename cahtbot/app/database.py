@@ -1,6 +1,8 @@
 import psycopg2
 from psycopg2 import pool
+import asyncpg
 from app.config import settings
+from app.services.vector_index import search_settings
 import logging
 
 logger = logging.getLogger(__name__)
@@ -8,6 +10,9 @@ logger = logging.getLogger(__name__)
 # Global connection pool
 connection_pool = None
 
+# Global async connection pool (used by the async request path)
+async_pool = None
+
 def init_connection_pool():
     """Initialize the database connection pool"""
     global connection_pool
@@ -43,3 +48,61 @@ def close_all_connections():
     if connection_pool:
         connection_pool.closeall()
         logger.info("All database connections closed")
+
+def format_vector(values) -> str:
+    """Serialize a sequence of floats to the pgvector text format"""
+    return "[" + ",".join(str(float(x)) for x in values) + "]"
+
+def parse_vector(text: str) -> list[float]:
+    """Parse the pgvector text format back into a list of floats"""
+    return [float(x) for x in text.strip("[]").split(",") if x]
+
+async def _init_async_connection(conn):
+    """Per-connection setup: teach asyncpg the pgvector text format"""
+    await conn.set_type_codec(
+        "vector",
+        encoder=lambda v: v if isinstance(v, str) else format_vector(v),
+        decoder=parse_vector,
+        schema="public",
+        format="text",
+    )
+
+async def init_async_pool():
+    """Initialize the asyncpg connection pool"""
+    global async_pool
+    if async_pool is not None:
+        return async_pool
+    try:
+        async_pool = await asyncpg.create_pool(
+            min_size=settings.DB_ASYNC_POOL_MIN,
+            max_size=settings.DB_ASYNC_POOL_MAX,
+            host=settings.DB_HOST,
+            port=int(settings.DB_PORT),
+            database=settings.DB_NAME,
+            user=settings.DB_USER,
+            password=settings.DB_PASSWORD,
+            ssl=settings.DB_SSLMODE,
+            command_timeout=settings.DB_COMMAND_TIMEOUT,
+            # Connection defaults for ANN searches (ef_search / probes)
+            server_settings=search_settings(),
+            init=_init_async_connection,
+        )
+        logger.info("✅ Async database connection pool created successfully")
+        return async_pool
+    except Exception as e:
+        logger.error(f"❌ Error creating async connection pool: {e}")
+        raise
+
+async def get_async_pool():
+    """Get the async pool, creating it on first use"""
+    if async_pool is None:
+        await init_async_pool()
+    return async_pool
+
+async def close_async_pool():
+    """Close all connections in the async pool"""
+    global async_pool
+    if async_pool:
+        await async_pool.close()
+        async_pool = None
+        logger.info("All async database connections closed")
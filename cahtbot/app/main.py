@@ -4,7 +4,8 @@ import uuid
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
 from starlette.middleware.base import BaseHTTPMiddleware
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -12,8 +13,16 @@ from slowapi.errors import RateLimitExceeded
 from datetime import datetime
 
 from app.routers import chat
-from app.database import get_connection, return_connection, init_connection_pool, close_all_connections
+from app.database import init_connection_pool, close_all_connections, init_async_pool, get_async_pool, close_async_pool
 from app.config import settings
+from app.services.job_service import reindex_jobs
+from app.services.cache_service import answer_cache
+from app.services.llm_service import init_http_client, close_http_client
+from app.services.persistence_queue import message_write_queue
+from app.services.conversation_cache import conversation_cache
+from app.services.memory_index import memory_index, RETRIEVAL_BACKENDS
+from app.services.onnx_embedder import EMBED_BACKENDS
+from app.services.embedding_executor import embedding_executor
 
 # Logging Setup
 logging.basicConfig(
@@ -29,8 +38,8 @@ logger = logging.getLogger(__name__)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("httpcore").setLevel(logging.WARNING)
 
-from app.services.rag_service import load_embedding_model, embed_model
-import threading
+from app.services.rag_service import query_embedding_cache
+from app.services.startup_service import model_startup, since_process_start
 
 # Request ID Middleware
 class RequestIDMiddleware(BaseHTTPMiddleware):
@@ -58,15 +67,36 @@ app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 @app.on_event("startup")
 async def startup_event():
     logger.info("🚀 Server starting up...")
-    # Initialize connection pool
+    # Initialize connection pools (sync pool is kept for indexing jobs)
     init_connection_pool()
-    # Load model in background to avoid blocking critical path
-    threading.Thread(target=load_embedding_model, daemon=True).start()
-    logger.info("✅ Startup completed")
+    await init_async_pool()
+    init_http_client()
+    conversation_cache.init()
+    if settings.PERSIST_WRITE_BEHIND:
+        message_write_queue.start()
+    if settings.RETRIEVAL_BACKEND not in RETRIEVAL_BACKENDS:
+        raise ValueError(f"Unknown RETRIEVAL_BACKEND '{settings.RETRIEVAL_BACKEND}', expected one of {RETRIEVAL_BACKENDS}")
+    if settings.RETRIEVAL_BACKEND == "memory":
+        memory_index.start()
+    if settings.EMBED_BACKEND not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown EMBED_BACKEND '{settings.EMBED_BACKEND}', expected one of {EMBED_BACKENDS}")
+    embedding_executor.start()
+    # Load and warm up the model in background to avoid blocking critical path
+    model_startup.start()
+    logger.info(f"✅ Startup completed ({since_process_start():.2f}s after process start, model loading)")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("🛑 Server shutting down...")
+    reindex_jobs.shutdown()
+    model_startup.stop()
+    embedding_executor.stop()
+    memory_index.stop()
+    await close_http_client()
+    # Flush queued messages while the pool is still open
+    await message_write_queue.stop()
+    await conversation_cache.close()
+    await close_async_pool()
     close_all_connections()
     logger.info("✅ Shutdown completed")
 
@@ -91,7 +121,7 @@ app.add_middleware(
 app.include_router(chat.router)
 
 @app.get("/health")
-def health_check():
+async def health_check():
     """Enhanced health check endpoint"""
     health_status = {
         "status": "healthy",
@@ -101,11 +131,9 @@ def health_check():
     
     # Check database
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1;")
-        cur.close()
-        return_connection(conn)
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1;")
         health_status["checks"]["database"] = "connected"
     except Exception as e:
         logger.error(f"Database health check failed: {e}")
@@ -113,7 +141,17 @@ def health_check():
         health_status["checks"]["database"] = f"error: {str(e)}"
     
     # Check embedding model
-    health_status["checks"]["embedding_model"] = "loaded" if embed_model else "not_loaded"
+    health_status["checks"]["embedding_model"] = "loaded" if model_startup.ready else model_startup.status
+    health_status["checks"]["embedding_backend"] = settings.EMBED_BACKEND
+    health_status["checks"]["embedding_executor"] = embedding_executor.stats()
+    
+    # Cache statistics
+    health_status["checks"]["query_embedding_cache"] = query_embedding_cache.stats()
+    health_status["checks"]["answer_cache"] = answer_cache.stats()
+    health_status["checks"]["conversation_cache"] = conversation_cache.stats()
+    health_status["checks"]["retrieval_backend"] = settings.RETRIEVAL_BACKEND
+    if settings.RETRIEVAL_BACKEND == "memory":
+        health_status["checks"]["memory_index"] = memory_index.stats()
     
     # Check Groq API key
     health_status["checks"]["groq_api"] = "configured" if settings.GROQ_API_KEY else "not_configured"
@@ -128,6 +166,23 @@ def health_check():
     
     return health_status
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    Readiness probe: 503 until the embedding model is loaded and warmed up.
+    /health stays a liveness check and answers as soon as the process is up.
+    """
+    readiness = model_startup.readiness()
+    if settings.RETRIEVAL_BACKEND == "memory":
+        # Informational: pgvector serves searches until the matrix is loaded
+        readiness["memory_index"] = "loaded" if memory_index.ready else "loading"
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage chat latency, pools, model state, caches and Groq tokens"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @app.get("/", response_class=HTMLResponse)
 async def root():
     try:
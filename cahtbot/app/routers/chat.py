@@ -1,135 +1,425 @@
 from fastapi import APIRouter, HTTPException, Request
-from pydantic import BaseModel
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+import json
+from datetime import date
 import logging
 
-from app.services.rag_service import retrieve_context
-from app.services.llm_service import call_groq_api, build_system_prompt
+from app.services.rag_service import retrieve_documents_async, retrieve_documents_batch_async
+from app.services.llm_service import generate_answer, AnswerStream, needs_rewrite, rewrite_query
+from app.services.prompt_service import build_messages, select_context
+from app.services.cache_service import answer_cache, context_key
+from app.config import settings
 from app.exceptions import DatabaseException, ModelException, ChatbotException
-from app.services.indexing_service import indexing_service
+from app.services.indexing_service import REINDEX_MODES
+from app.services.job_service import reindex_jobs, ROLLBACK
 import asyncio
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
 from app.services.history_service import history_service
+from app.services.persistence_queue import message_write_queue
+from app.services.conversation_cache import conversation_cache
+from app.services.metrics_service import stage_timer, observe_stage
+
+class RetrievalFilters(BaseModel):
+    """Structured prefilters applied before ranking the context chunks"""
+    source_tables: list[str] | None = None
+    origin_city: str | None = None
+    destination_city: str | None = None
+    departure_from: date | None = None
+    departure_to: date | None = None
 
 class ChatRequest(BaseModel):
     message: str
     user_id: str | None = None
-    max_results: int = 5
+    max_results: int = Field(5, ge=1, le=settings.RETRIEVAL_MAX_RESULTS)
+    filters: RetrievalFilters | None = None
+
+    def retrieval_filters(self) -> dict | None:
+        return self.filters.model_dump(exclude_none=True) if self.filters else None
 
 class ChatResponse(BaseModel):
     answer: str
     context_used: list[str] | None = None
     request_id: str | None = None
 
-@router.post("/system/reindex")
-async def reindex_endpoint(request: Request):
+class BatchRetrievalRequest(BaseModel):
+    queries: list[str]
+    max_results: int = Field(5, ge=1, le=settings.RETRIEVAL_MAX_RESULTS)
+    filters: RetrievalFilters | None = None
+
+class RetrievedDocument(BaseModel):
+    text_chunk: str
+    source_table: str
+    source_id: str
+    distance: float
+
+class QueryResults(BaseModel):
+    query: str
+    documents: list[RetrievedDocument]
+
+class BatchRetrievalResponse(BaseModel):
+    results: list[QueryResults]
+    request_id: str | None = None
+
+@router.post("/system/reindex", status_code=202)
+async def reindex_endpoint(request: Request, mode: str = "shadow"):
     """
-    Trigger a full re-indexing of the database.
-    In a real production app, this should be protected by Auth and run as a Background Task.
+    Queue a re-indexing of the database (mode: shadow | full | incremental)
+    and return its job id immediately; poll /system/reindex/{job_id} for progress.
+    The default shadow mode keeps serving the current embeddings until the new set is swapped in.
+    In a real production app, this should be protected by Auth.
     """
     request_id = getattr(request.state, 'request_id', 'unknown')
-    logger.info(f"[{request_id}] Re-indexing triggered via API")
-    
-    # Run in background/thread pool because it's CPU intensive
-    try:
-        # We wrap the synchronous reindex_all in to_thread to avoid blocking event loop
-        result = await asyncio.to_thread(indexing_service.reindex_all)
-        return result
-    except Exception as e:
-        logger.error(f"[{request_id}] Re-indexing failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    logger.info(f"[{request_id}] Re-indexing ({mode}) triggered via API")
 
+    if mode not in REINDEX_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(REINDEX_MODES)}")
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat_endpoint(req: ChatRequest, request: Request):
+    # Jobs run one at a time on the dedicated re-index worker thread
+    job = reindex_jobs.submit(mode)
+    return job.to_dict()
+
+
+@router.get("/system/reindex/jobs")
+async def reindex_jobs_endpoint():
+    """Recent re-index jobs, newest first"""
+    return reindex_jobs.list_jobs()
+
+
+@router.get("/system/reindex/{job_id}")
+async def reindex_status_endpoint(job_id: str):
+    """Status and progress (rows embedded, rows/sec, ETA) of a re-index job"""
+    job = reindex_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.post("/system/reindex/rollback")
+async def reindex_rollback_endpoint(request: Request):
     """
-    Chat endpoint with rate limiting and enhanced error handling
+    Swap the previous embeddings generation back in after a shadow re-index.
     """
     request_id = getattr(request.state, 'request_id', 'unknown')
+    logger.info(f"[{request_id}] Embeddings rollback triggered via API")
+
+    # Runs on the re-index worker, so no job can start until it is done
+    job = reindex_jobs.submit(ROLLBACK, exclusive=True)
+    if job is None:
+        raise HTTPException(status_code=409, detail="A re-index job is queued or running")
+
+    await asyncio.to_thread(job.done.wait)
+    if isinstance(job.exception, ValueError):
+        raise HTTPException(status_code=409, detail=job.error)
+    if job.exception is not None:
+        logger.error(f"[{request_id}] Rollback failed: {job.error}")
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
+
+
+class ChatTurn:
+    """State gathered before the answer is generated (shared by /chat and /chat/stream)"""
+
+    def __init__(self, user_id: str, conversation_id: str, history: list[dict]):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.history = history
+        self.query_emb = None
+        self.documents: list[dict] = []
+        self.cache_key = None
+        self.cached_answer = None
+        self.messages: list[dict] = []
+        # Chunks that made it into the prompt (context_used in the response)
+        self.context_used: list[str] = []
+
+    @property
+    def context_chunks(self) -> list[str]:
+        return [d["text_chunk"] for d in self.documents]
+
+
+async def _prepare_turn(req: ChatRequest, request_id: str) -> ChatTurn:
+    """Steps 1-5: conversation, history, query rewriting, retrieval and prompt"""
+    logger.info(f"[{request_id}] Received chat request: {req.message[:50]}...")
     
-    try:
-        logger.info(f"[{request_id}] Received chat request: {req.message[:50]}...")
-        
-        if not req.message or len(req.message.strip()) == 0:
-            raise HTTPException(status_code=400, detail="الرسالة فارغة")
+    if not req.message or len(req.message.strip()) == 0:
+        raise HTTPException(status_code=400, detail="الرسالة فارغة")
 
-        user_id = req.user_id or "default_user"
-        
-        # 1. Get/Create Conversation & Retrieve History
+    user_id = req.user_id or "default_user"
+    
+    # 1. Get/Create Conversation & Retrieve History (hot cache first)
+    with stage_timer("conversation_lookup"):
+        cached = await conversation_cache.get(user_id)
+    if cached is not None:
+        conversation_id, history = cached
+    else:
+        # Taken before the read, so a turn flushed meanwhile is not missed
+        pending = message_write_queue.pending()
         try:
-            conversation_id = history_service.get_or_create_conversation(user_id)
-            history = history_service.get_recent_messages(conversation_id, limit=10)
+            with stage_timer("history_fetch"):
+                conversation_id, history = await history_service.get_conversation_with_history_async(
+                    user_id, limit=settings.CONVERSATION_CACHE_MESSAGES
+                )
         except Exception as e:
             logger.error(f"[{request_id}] Database error in conversation management: {e}")
             raise DatabaseException("خطأ في إدارة المحادثة")
+        if conversation_id in pending:
+            history = message_write_queue.with_pending(history, pending[conversation_id])
+            history = history[-settings.CONVERSATION_CACHE_MESSAGES:]
+        await conversation_cache.set(user_id, conversation_id, history)
+    turn = ChatTurn(user_id, conversation_id, history)
 
-        # 2. Query Rewriting
-        search_query = req.message
-        if len(history) > 0:
-             try:
-                 context_history = "\n".join([f"{m['role']}: {m['content']}" for m in history[-2:]])
-                 rewrite_prompt = [
-                     {"role": "system", "content": "أنت مساعد بحثي. أعد صياغة سؤال المستخدم الأخير ليكون سؤالاً مكتملاً مستقلاً يصلح للبحث في قاعدة البيانات، مع مراعاة سياق المحادثة السابقة إذا لزم الأمر."},
-                     {"role": "user", "content": f"سياق سابق:\n{context_history}\n\nسؤال المستخدم الحالي: {req.message}\n\nالصياغة البحثية:"}
-                 ]
-                 rewritten = await call_groq_api(rewrite_prompt)
-                 if rewritten and len(rewritten) < 200:
-                     logger.info(f"[{request_id}] Query rewritten: '{req.message}' -> '{rewritten}'")
-                     search_query = rewritten
-             except Exception as e:
-                 logger.warning(f"[{request_id}] Failed to rewrite query: {e}")
-
-        # 3. Retrieve Context
-        try:
-            context_chunks = retrieve_context(search_query, k=req.max_results)
-        except Exception as e:
-            logger.error(f"[{request_id}] Error retrieving context: {e}")
-            context_chunks = []
-        
-        # 4. Build System Prompt
-        system_instruction = build_system_prompt(context_chunks)
+    # 2-3. Query Rewriting & Retrieve Context
+    try:
+        turn.query_emb, turn.documents = await _retrieve_for_turn(req, history, request_id)
+    except Exception as e:
+        logger.error(f"[{request_id}] Error retrieving context: {e}")
 
-        # 5. Prepare Messages for LLM
-        messages = [{"role": "system", "content": system_instruction}]
-        messages.extend(history)
-        messages.append({"role": "user", "content": req.message})
+    # History-free questions can reuse an answer given for a near-identical
+    # question over the same retrieved rows
+    if not history and turn.query_emb is not None:
+        turn.cache_key = context_key(turn.documents)
+        turn.cached_answer = answer_cache.lookup(turn.query_emb, turn.cache_key)
+        if turn.cached_answer is not None:
+            logger.info(f"[{request_id}] Semantic answer cache hit")
+            turn.context_used = select_context(turn.context_chunks)
+            return turn
 
-        # 6. Call LLM
-        try:
-            answer_raw = await call_groq_api(messages)
-        except Exception as e:
-            logger.error(f"[{request_id}] Error calling LLM: {e}")
-            raise ModelException("خطأ في نموذج الذكاء الاصطناعي")
-        
-        # 7. Save to Database
+    # 4-5. System prompt and messages for the LLM, within the token budgets
+    with stage_timer("prompt_build"):
+        turn.messages, turn.context_used = build_messages(turn.context_chunks, history, req.message)
+    return turn
+
+
+async def _rewrite_and_retrieve(req: ChatRequest, history: list[dict], request_id: str):
+    """Sequential path: rewrite the question first, then search with the result"""
+    search_query = req.message
+    try:
+        rewritten = await rewrite_query(req.message, history)
+        if rewritten:
+            logger.info(f"[{request_id}] Query rewritten: '{req.message}' -> '{rewritten}'")
+            search_query = rewritten
+    except Exception as e:
+        logger.warning(f"[{request_id}] Failed to rewrite query: {e}")
+    return await retrieve_documents_async(search_query, k=req.max_results, filters=req.retrieval_filters())
+
+
+async def _retrieve_for_turn(req: ChatRequest, history: list[dict], request_id: str):
+    """
+    Retrieve context for this turn, rewriting follow-up questions first.
+
+    Self-contained messages skip the rewrite. In pipelined mode retrieval on
+    the raw message starts alongside the rewrite, and its results are used
+    when the rewrite is slower than QUERY_REWRITE_TIMEOUT or unusable.
+    """
+    if not needs_rewrite(req.message, history):
+        return await retrieve_documents_async(req.message, k=req.max_results, filters=req.retrieval_filters())
+
+    if settings.QUERY_REWRITE_MODE != "pipelined":
+        return await _rewrite_and_retrieve(req, history, request_id)
+
+    raw_task = asyncio.create_task(retrieve_documents_async(req.message, k=req.max_results, filters=req.retrieval_filters()))
+    # Its result may be discarded; make sure a failure is not reported as unretrieved
+    raw_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    rewrite_task = asyncio.create_task(rewrite_query(req.message, history))
+    try:
+        rewritten = await asyncio.wait_for(rewrite_task, timeout=settings.QUERY_REWRITE_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.info(f"[{request_id}] Query rewrite too slow, using raw-query results")
+        rewritten = None
+    except Exception as e:
+        logger.warning(f"[{request_id}] Failed to rewrite query: {e}")
+        rewritten = None
+
+    if not rewritten:
+        return await raw_task
+
+    logger.info(f"[{request_id}] Query rewritten: '{req.message}' -> '{rewritten}'")
+    raw_task.cancel()
+    return await retrieve_documents_async(rewritten, k=req.max_results, filters=req.retrieval_filters())
+
+
+async def _save_turn(turn: ChatTurn, req: ChatRequest, answer: str, from_model: bool, request_id: str):
+    """Step 7: cache the answer if eligible and persist the turn's messages (write-through)"""
+    if turn.cache_key and from_model:
+        answer_cache.store(turn.query_emb, turn.cache_key, answer)
+
+    messages = [{"role": "user", "content": req.message}]
+    # An interrupted stream may not have produced any answer text
+    if answer:
+        messages.append({"role": "assistant", "content": answer})
+    with stage_timer("persistence"):
+        await conversation_cache.append(turn.user_id, turn.conversation_id, messages)
         try:
-            history_service.add_message(conversation_id, "user", req.message)
-            history_service.add_message(conversation_id, "assistant", answer_raw)
+            await message_write_queue.submit(turn.conversation_id, messages)
         except Exception as e:
             logger.error(f"[{request_id}] Error saving messages: {e}")
             # Don't fail the request if saving fails
+
+
+def _chat_http_error(e: Exception, request_id: str) -> HTTPException:
+    """Map chat pipeline exceptions to the HTTP error returned to the client"""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, DatabaseException):
+        logger.error(f"[{request_id}] Database error: {e}")
+        return HTTPException(status_code=503, detail="خطأ في الاتصال بقاعدة البيانات")
+    if isinstance(e, ModelException):
+        logger.error(f"[{request_id}] Model error: {e}")
+        return HTTPException(status_code=500, detail="خطأ في نموذج الذكاء الاصطناعي")
+    if isinstance(e, ChatbotException):
+        logger.error(f"[{request_id}] Chatbot error: {e}")
+        return HTTPException(status_code=500, detail="حدث خطأ في النظام")
+    logger.error(f"[{request_id}] Unexpected error in chat endpoint: {e}", exc_info=True)
+    return HTTPException(status_code=500, detail="حدث خطأ غير متوقع")
+
+
+@router.post("/retrieve/batch", response_model=BatchRetrievalResponse)
+async def retrieve_batch_endpoint(req: BatchRetrievalRequest, request: Request):
+    """
+    Context retrieval for several queries in one call (e.g. a message and its
+    rewrite, multi-city questions, evaluation runs): one encode call and one
+    database round-trip. Results keep the order of `queries`.
+    """
+    request_id = getattr(request.state, 'request_id', 'unknown')
+    if not req.queries or any(not q.strip() for q in req.queries):
+        raise HTTPException(status_code=400, detail="الاستعلامات فارغة")
+    if len(req.queries) > settings.BATCH_RETRIEVAL_MAX_QUERIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"الحد الأقصى لعدد الاستعلامات هو {settings.BATCH_RETRIEVAL_MAX_QUERIES}",
+        )
+
+    try:
+        results = await retrieve_documents_batch_async(
+            req.queries,
+            k=req.max_results,
+            filters=req.filters.model_dump(exclude_none=True) if req.filters else None,
+        )
+    except Exception as e:
+        logger.error(f"[{request_id}] Error in batch retrieval: {e}")
+        raise HTTPException(status_code=503, detail="خطأ في الاتصال بقاعدة البيانات")
+
+    return BatchRetrievalResponse(
+        results=[
+            QueryResults(
+                query=query,
+                documents=[{**d, "source_id": str(d["source_id"])} for d in documents],
+            )
+            for query, documents in zip(req.queries, results)
+        ],
+        request_id=request_id,
+    )
+
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(req: ChatRequest, request: Request):
+    """
+    Chat endpoint with rate limiting and enhanced error handling
+    """
+    request_id = getattr(request.state, 'request_id', 'unknown')
+    
+    try:
+        turn = await _prepare_turn(req, request_id)
+
+        if turn.cached_answer is not None:
+            answer_raw, from_model = turn.cached_answer, False
+        else:
+            # 6. Call LLM
+            try:
+                with stage_timer("llm_call"):
+                    answer_raw, from_model = await generate_answer(turn.messages)
+            except Exception as e:
+                logger.error(f"[{request_id}] Error calling LLM: {e}")
+                raise ModelException("خطأ في نموذج الذكاء الاصطناعي")
+        
+        # 7. Save to Database
+        await _save_turn(turn, req, answer_raw, from_model, request_id)
         
         logger.info(f"[{request_id}] Request completed successfully")
         
         return ChatResponse(
             answer=answer_raw,
-            context_used=context_chunks if context_chunks else None,
+            context_used=turn.context_used or None,
             request_id=request_id
         )
             
-    except HTTPException:
-        raise
-    except DatabaseException as e:
-        logger.error(f"[{request_id}] Database error: {e}")
-        raise HTTPException(status_code=503, detail="خطأ في الاتصال بقاعدة البيانات")
-    except ModelException as e:
-        logger.error(f"[{request_id}] Model error: {e}")
-        raise HTTPException(status_code=500, detail="خطأ في نموذج الذكاء الاصطناعي")
-    except ChatbotException as e:
-        logger.error(f"[{request_id}] Chatbot error: {e}")
-        raise HTTPException(status_code=500, detail="حدث خطأ في النظام")
     except Exception as e:
-        logger.error(f"[{request_id}] Unexpected error in chat endpoint: {e}", exc_info=True)
-        raise HTTPException(status_code=500, detail="حدث خطأ غير متوقع")
+        raise _chat_http_error(e, request_id)
+
+
+# Saves of interrupted streams, referenced until done so they are not garbage-collected
+_background_saves: set[asyncio.Task] = set()
+
+
+def _save_in_background(coro):
+    task = asyncio.ensure_future(coro)
+    _background_saves.add(task)
+    task.add_done_callback(_background_saves.discard)
+
+
+def _sse(data: dict, event: str | None = None) -> str:
+    """Format one server-sent event"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream_endpoint(req: ChatRequest, request: Request):
+    """
+    Streaming variant of /chat: answer tokens are sent as server-sent events
+    (`data: {"token": ...}`) as Groq produces them, followed by a `done`
+    event carrying request_id and context_used, or an `error` event.
+    The assembled answer is saved to history once the stream ends.
+    """
+    request_id = getattr(request.state, 'request_id', 'unknown')
+
+    try:
+        turn = await _prepare_turn(req, request_id)
+    except Exception as e:
+        raise _chat_http_error(e, request_id)
+
+    async def event_stream():
+        parts = []
+        stream = None
+        save = None
+        try:
+            if turn.cached_answer is not None:
+                parts.append(turn.cached_answer)
+                yield _sse({"token": turn.cached_answer})
+                from_model = False
+            else:
+                # 6. Stream LLM tokens
+                stream = AnswerStream(turn.messages)
+                async for token in stream:
+                    parts.append(token)
+                    yield _sse({"token": token})
+                from_model = stream.from_model
+
+            # 7. Save to Database before `done`, so the client's next turn sees this one.
+            # Shielded: a disconnect while saving must not cut the save short.
+            save = asyncio.ensure_future(_save_turn(turn, req, "".join(parts), from_model, request_id))
+            await asyncio.shield(save)
+            logger.info(f"[{request_id}] Streamed request completed successfully")
+
+            yield _sse({"request_id": request_id, "context_used": turn.context_used or None}, event="done")
+        except Exception as e:
+            logger.error(f"[{request_id}] Error streaming LLM answer: {e}")
+            yield _sse({"detail": "خطأ في نموذج الذكاء الاصطناعي"}, event="error")
+        finally:
+            if stream is not None:
+                # Time spent waiting on Groq only, not on the client reading the stream
+                observe_stage("llm_call", stream.upstream_seconds)
+            if save is None:
+                # LLM error or client disconnect: keep the question and whatever
+                # was generated (never cached as an answer). The web client does
+                # not retry such a turn through /chat, so it is saved only once.
+                _save_in_background(_save_turn(turn, req, "".join(parts), False, request_id))
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Request-ID": request_id},
+    )
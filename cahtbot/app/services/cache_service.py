@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from app.config import settings
+from app.services.embedding_store import content_hash
+
+# Arabic diacritics (harakat) and tatweel do not change the meaning of a query
+_ARABIC_MARKS = re.compile(r"[ً-ْٰـ]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Canonical form of a user query, used as a cache key"""
+    text = unicodedata.normalize("NFKC", text)
+    text = _ARABIC_MARKS.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live and hit/miss counters.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key, default=None):
+        """Read a live entry without touching recency or the hit/miss counters"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                return entry[0]
+            return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+def context_key(documents: list[dict]) -> tuple:
+    """
+    Identity of a retrieved context: sorted (source_table, source_id, content_hash
+    of the text) triples. A row whose text changed (a new price or time) gives
+    a different key, so answers built on the old text are never reused, even
+    when another worker or build_embeddings.py did the re-index.
+    """
+    return tuple(sorted(
+        (d["source_table"], str(d["source_id"]), content_hash(d["text_chunk"]))
+        for d in documents
+    ))
+
+
+class SemanticAnswerCache:
+    """
+    Reuses a generated answer for a new question whose embedding is within
+    `threshold` cosine similarity of a cached question that was answered from
+    exactly the same retrieved context.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, threshold: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        # context key -> list of [unit query vector, answer, expires_at]
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, query_emb, key: tuple) -> str | None:
+        if not key:
+            return None
+        with self._lock:
+            now = time.monotonic()
+            entries = [e for e in self._entries.get(key, []) if e[2] > now]
+            self._size -= len(self._entries.get(key, [])) - len(entries)
+            if entries:
+                self._entries[key] = entries
+                self._entries.move_to_end(key)
+                scores = np.stack([e[0] for e in entries]) @ self._unit(query_emb)
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self.hits += 1
+                    return entries[best][1]
+            else:
+                self._entries.pop(key, None)
+            self.misses += 1
+            return None
+
+    def store(self, query_emb, key: tuple, answer: str):
+        if not key or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries.setdefault(key, []).append([self._unit(query_emb), answer, time.monotonic() + self.ttl])
+            self._entries.move_to_end(key)
+            self._size += 1
+            # Evict least recently used contexts until within bounds
+            while self._size > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, sources: set[tuple] | None = None):
+        """
+        Drop answers built on the given (source_table, source_id) pairs,
+        or everything when sources is None. Only frees memory early: entries
+        for changed rows can no longer match a lookup (see context_key).
+        """
+        with self._lock:
+            if sources is None:
+                self._entries.clear()
+                self._size = 0
+                return
+            for key in [k for k in self._entries if any(row[:2] in sources for row in k)]:
+                self._size -= len(self._entries.pop(key))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+answer_cache = SemanticAnswerCache(
+    settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIMILARITY
+)
@@ -0,0 +1,189 @@
+import json
+import logging
+from app.config import settings
+from app.services.cache_service import TTLCache
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_CACHE_BACKENDS = ("memory", "redis", "none")
+
+
+class InMemoryConversationBackend:
+    """Process-local backend for single-node deployments and test runs"""
+
+    name = "memory"
+
+    def __init__(self, maxsize: int, ttl: float):
+        # user_id -> (conversation_id, recent messages)
+        self._states = TTLCache(maxsize, ttl)
+
+    async def get(self, user_id: str) -> tuple[str, list[dict]] | None:
+        state = self._states.get(user_id)
+        if state is None:
+            return None
+        conversation_id, messages = state
+        return conversation_id, list(messages)
+
+    async def set(self, user_id: str, conversation_id: str, messages: list[dict]):
+        self._states.set(user_id, (conversation_id, list(messages)))
+
+    async def append(self, user_id: str, conversation_id: str, messages: list[dict], keep: int) -> bool:
+        state = self._states.peek(user_id)
+        if state is None or state[0] != conversation_id:
+            return False
+        self._states.set(user_id, (conversation_id, (state[1] + messages)[-keep:]))
+        return True
+
+    def stats(self) -> dict:
+        return self._states.stats()
+
+    async def close(self):
+        pass
+
+
+class RedisConversationBackend:
+    """
+    Shared backend so every worker sees the same conversation state.
+    Each user's state is a single JSON value, so a lookup is one GET.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, ttl: float):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self._ttl = max(int(ttl), 1)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(user_id: str) -> str:
+        return f"chatbot:conversation:{user_id}"
+
+    @staticmethod
+    def _dump(conversation_id: str, messages: list[dict]) -> str:
+        return json.dumps({"conversation_id": conversation_id, "messages": messages}, ensure_ascii=False)
+
+    async def get(self, user_id: str) -> tuple[str, list[dict]] | None:
+        raw = await self._redis.get(self._key(user_id))
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        state = json.loads(raw)
+        return state["conversation_id"], state["messages"]
+
+    async def set(self, user_id: str, conversation_id: str, messages: list[dict]):
+        await self._redis.set(self._key(user_id), self._dump(conversation_id, messages), ex=self._ttl)
+
+    async def append(self, user_id: str, conversation_id: str, messages: list[dict], keep: int) -> bool:
+        from redis.exceptions import WatchError
+
+        key = self._key(user_id)
+        async with self._redis.pipeline() as pipe:
+            # Optimistic read-modify-write; retried if another turn wrote the key meanwhile
+            for _ in range(3):
+                try:
+                    await pipe.watch(key)
+                    raw = await pipe.get(key)
+                    if raw is None:
+                        await pipe.unwatch()
+                        return False
+                    state = json.loads(raw)
+                    if state["conversation_id"] != conversation_id:
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.set(key, self._dump(conversation_id, (state["messages"] + messages)[-keep:]), ex=self._ttl)
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    continue
+        # Could not apply the update; drop the entry so the next turn reloads it
+        await self._redis.delete(key)
+        return False
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+class ConversationCache:
+    """
+    Hot cache of each user's current conversation id and last N messages,
+    so a chat turn does not have to read Postgres before it can start.
+
+    Write-through: _save_turn appends the turn here and hands the same
+    messages to the persistence queue. A miss or a backend error falls back
+    to Postgres, which stays the source of truth; entries expire after
+    CONVERSATION_CACHE_TTL seconds without activity.
+    """
+
+    def __init__(self):
+        self._backend = None
+
+    def init(self):
+        """Create the configured backend (called on startup)"""
+        backend = settings.CONVERSATION_CACHE_BACKEND
+        if backend not in CONVERSATION_CACHE_BACKENDS:
+            raise ValueError(f"Unknown CONVERSATION_CACHE_BACKEND '{backend}', expected one of {CONVERSATION_CACHE_BACKENDS}")
+        if backend == "redis":
+            self._backend = RedisConversationBackend(settings.REDIS_URL, settings.CONVERSATION_CACHE_TTL)
+        elif backend == "memory":
+            if settings.WEB_CONCURRENCY > 1:
+                logger.warning(
+                    f"⚠️ CONVERSATION_CACHE_BACKEND=memory with {settings.WEB_CONCURRENCY} workers: "
+                    f"each worker caches its own copy and can serve stale history; use redis or none"
+                )
+            self._backend = InMemoryConversationBackend(settings.CONVERSATION_CACHE_SIZE, settings.CONVERSATION_CACHE_TTL)
+        else:
+            self._backend = None
+        logger.info(f"✅ Conversation cache backend: {backend}")
+
+    async def get(self, user_id: str) -> tuple[str, list[dict]] | None:
+        if not self._backend:
+            return None
+        try:
+            return await self._backend.get(user_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Conversation cache lookup failed, reading from the database: {e}")
+            return None
+
+    async def set(self, user_id: str, conversation_id: str, history: list[dict]):
+        if not self._backend:
+            return
+        try:
+            await self._backend.set(user_id, conversation_id, history[-settings.CONVERSATION_CACHE_MESSAGES:])
+        except Exception as e:
+            logger.warning(f"⚠️ Conversation cache update failed: {e}")
+
+    async def append(self, user_id: str, conversation_id: str, messages: list[dict]):
+        """Add the messages of a finished turn to an already cached conversation"""
+        if not self._backend:
+            return
+        try:
+            await self._backend.append(user_id, conversation_id, messages, settings.CONVERSATION_CACHE_MESSAGES)
+        except Exception as e:
+            logger.warning(f"⚠️ Conversation cache update failed: {e}")
+
+    def stats(self) -> dict:
+        if not self._backend:
+            return {"backend": "none"}
+        return {"backend": self._backend.name, **self._backend.stats()}
+
+    async def close(self):
+        """Release the backend connection (called on shutdown)"""
+        if self._backend:
+            await self._backend.close()
+            self._backend = None
+
+
+conversation_cache = ConversationCache()
@@ -0,0 +1,218 @@
+import asyncio
+import itertools
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from app.config import settings
+from app.exceptions import ModelException
+from app.services.metrics_service import EMBEDDING_QUEUE_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+ONLINE = 0
+REINDEX = 1
+PRIORITY_NAMES = {ONLINE: "online", REINDEX: "reindex"}
+
+
+class EmbeddingExecutor:
+    """
+    Dedicated worker threads that own every embed_model.encode call, so a
+    transformer forward pass never runs on the event loop.
+
+    Work is queued by priority: online queries (chat, retrieval endpoints)
+    are taken before re-index batches, and a re-index submits one batch at a
+    time so a query waits for at most one batch. The queue is bounded by
+    EMBED_QUEUE_SIZE: an online submit fails fast with ModelException when it
+    is full, a re-index submit blocks until there is room.
+
+    Online queries that arrive together are micro-batched into one encode
+    call (see _collect), which multiplies throughput under bursts while a
+    lone query waits at most EMBED_MICROBATCH_MAX_WAIT_MS.
+
+    Threads rather than processes: torch and ONNX Runtime release the GIL
+    during inference, and one in-process copy of the model is shared.
+    """
+
+    def __init__(self):
+        self._queue: queue.PriorityQueue | None = None
+        self._workers: list[threading.Thread] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._metrics = {priority: self._empty_metrics() for priority in PRIORITY_NAMES}
+
+    @staticmethod
+    def _empty_metrics() -> dict:
+        return {"queued": 0, "submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "batches": 0,
+                "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "encode_seconds_total": 0.0}
+
+    @property
+    def running(self) -> bool:
+        return any(worker.is_alive() for worker in self._workers)
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        """Start the worker threads (also done lazily by the first submit)"""
+        with self._lock:
+            if self.running:
+                return
+            self._queue = queue.PriorityQueue(maxsize=settings.EMBED_QUEUE_SIZE)
+            self._workers = [
+                threading.Thread(target=self._run, name=f"embedding-worker-{i}", daemon=True)
+                for i in range(max(1, settings.EMBED_EXECUTOR_THREADS))
+            ]
+            for worker in self._workers:
+                worker.start()
+        logger.info(f"✅ Embedding executor started ({len(self._workers)} threads, queue size {settings.EMBED_QUEUE_SIZE})")
+
+    def stop(self):
+        """Let the workers finish what is queued, then exit"""
+        if not self.running:
+            return
+        for _ in self._workers:
+            # Sorts after all real work
+            self._queue.put((max(PRIORITY_NAMES) + 1, next(self._sequence), None))
+        self._workers = []
+
+    def submit(self, texts: list[str], priority: int = ONLINE, model=None, batch_size: int | None = None) -> Future:
+        """Queue one encode call; the Future resolves to a NumPy array (one row per text)"""
+        if not self.running:
+            self.start()
+
+        future = Future()
+        item = (priority, next(self._sequence), (texts, model, batch_size, future, time.perf_counter()))
+        with self._lock:
+            self._metrics[priority]["queued"] += 1
+        try:
+            if priority == ONLINE:
+                self._queue.put_nowait(item)
+            else:
+                self._queue.put(item)
+        except queue.Full:
+            with self._lock:
+                self._metrics[priority]["queued"] -= 1
+                self._metrics[priority]["rejected"] += 1
+            raise ModelException(f"Embedding queue full ({settings.EMBED_QUEUE_SIZE} requests waiting)")
+        with self._lock:
+            self._metrics[priority]["submitted"] += 1
+        return future
+
+    def encode(self, texts: list[str], priority: int = ONLINE, model=None, batch_size: int | None = None):
+        """Blocking encode for worker threads and scripts"""
+        return self.submit(texts, priority, model, batch_size).result()
+
+    async def encode_async(self, texts: list[str], priority: int = ONLINE):
+        """Encode without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(texts, priority))
+
+    def _run(self):
+        carry = None
+        while True:
+            item, carry = carry or self._queue.get(), None
+            priority, _, work = item
+            if work is None:
+                break
+            batch = [work]
+            if priority == ONLINE and work[1] is None and work[2] is None:
+                batch, carry = self._collect(batch)
+            self._execute(priority, batch)
+
+    def _collect(self, batch: list) -> tuple[list, tuple | None]:
+        """
+        Micro-batching: add online queries already queued or arriving within
+        EMBED_MICROBATCH_MAX_WAIT_MS, up to EMBED_MICROBATCH_MAX_SIZE texts.
+        Returns the batch and the first queued item that could not join it.
+        """
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + settings.EMBED_MICROBATCH_MAX_WAIT_MS / 1000
+        while size < settings.EMBED_MICROBATCH_MAX_SIZE:
+            timeout = deadline - time.perf_counter()
+            try:
+                # Past the deadline, still take whatever is already waiting
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            priority, _, work = item
+            if priority != ONLINE or work is None or work[1] is not None or work[2] is not None:
+                return batch, item
+            if size + len(work[0]) > settings.EMBED_MICROBATCH_MAX_SIZE:
+                return batch, item
+            batch.append(work)
+            size += len(work[0])
+        return batch, None
+
+    def _execute(self, priority: int, batch: list):
+        """One encode call for every request in the batch; each future gets its own rows"""
+        from app.services.rag_service import get_embedding_model
+
+        started = time.perf_counter()
+        live = []
+        for texts, _, _, future, enqueued_at in batch:
+            waited = started - enqueued_at
+            if future.set_running_or_notify_cancel():
+                live.append((texts, future, waited))
+            else:
+                self._finish(priority, waited, 0.0, ok=False)
+        if not live:
+            return
+
+        _, model, batch_size, _, _ = batch[0]
+        texts = [text for request_texts, _, _ in live for text in request_texts]
+        try:
+            model = model or get_embedding_model()
+            if model is None:
+                raise ModelException("Embedding model not available")
+            embeddings = model.encode(
+                texts,
+                batch_size=batch_size or max(settings.EMBED_BATCH_SIZE, len(texts)),
+                show_progress_bar=False,
+                convert_to_numpy=True,
+            )
+            error = None
+        except Exception as e:
+            error = e
+        elapsed = time.perf_counter() - started
+
+        # Metrics first, so they are current once a caller sees its result
+        with self._lock:
+            self._metrics[priority]["batches"] += 1
+        for _, _, waited in live:
+            self._finish(priority, waited, elapsed, ok=error is None)
+
+        offset = 0
+        for request_texts, future, _ in live:
+            if error is None:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            else:
+                future.set_exception(error)
+
+    def _finish(self, priority: int, waited: float, encode_seconds: float, ok: bool):
+        EMBEDDING_QUEUE_WAIT_SECONDS.labels(PRIORITY_NAMES[priority]).observe(waited)
+        with self._lock:
+            metrics = self._metrics[priority]
+            metrics["queued"] -= 1
+            metrics["completed" if ok else "failed"] += 1
+            metrics["wait_seconds_total"] += waited
+            metrics["wait_seconds_max"] = max(metrics["wait_seconds_max"], waited)
+            metrics["encode_seconds_total"] += encode_seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {PRIORITY_NAMES[p]: dict(m) for p, m in self._metrics.items()}
+        for metrics in snapshot.values():
+            done = metrics["completed"] + metrics["failed"]
+            metrics["avg_wait_ms"] = round(metrics["wait_seconds_total"] / done * 1000, 2) if done else 0.0
+            metrics["max_wait_ms"] = round(metrics.pop("wait_seconds_max") * 1000, 2)
+            encode_seconds = metrics.pop("encode_seconds_total")
+            metrics["avg_encode_ms"] = round(encode_seconds / done * 1000, 2) if done else 0.0
+            metrics["avg_batch_requests"] = round(done / metrics["batches"], 2) if metrics["batches"] else 0.0
+            metrics.pop("wait_seconds_total")
+        return {"running": self.running, "threads": len(self._workers), "queue_depth": self.depth(), **snapshot}
+
+
+embedding_executor = EmbeddingExecutor()
@@ -0,0 +1,224 @@
+import csv
+import hashlib
+import io
+import logging
+from datetime import date, datetime
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+from app.config import settings
+from app.database import format_vector
+
+logger = logging.getLogger(__name__)
+
+# Structured prefilter columns stored next to the embedding (see retrieve_documents_async)
+FILTER_COLUMNS = ("origin_city", "destination_city", "departure_date")
+NO_FILTERS = (None, None, None)
+
+# Column order of the row tuples accepted by bulk_insert_embeddings
+EMBEDDING_COLUMNS = ("source_table", "source_id", "text_chunk", "content_hash", *FILTER_COLUMNS, "embedding")
+# Columns added by migration 004; without them rows are written without filters
+HYBRID_COLUMNS = (*FILTER_COLUMNS, "text_search")
+_LEGACY_COLUMNS = tuple(c for c in EMBEDDING_COLUMNS if c not in FILTER_COLUMNS)
+
+
+def has_hybrid_columns(cur, table: str = "documents_embeddings") -> bool:
+    """Whether migration 004 has added the prefilter and full-text columns to table"""
+    cur.execute(
+        """
+        SELECT count(*) FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s)
+        """,
+        (table, list(HYBRID_COLUMNS)),
+    )
+    return cur.fetchone()[0] == len(HYBRID_COLUMNS)
+
+
+def content_hash(text_chunk: str) -> str:
+    """Stable fingerprint of a chunk; a changed hash means the row needs re-embedding"""
+    return hashlib.sha256(text_chunk.encode("utf-8")).hexdigest()
+
+
+def filter_values(origin_city=None, destination_city=None, departure_time=None) -> tuple:
+    """Prefilter values of one row, ordered like FILTER_COLUMNS"""
+    if isinstance(departure_time, datetime):
+        departure_time = departure_time.date()
+    elif not isinstance(departure_time, date):
+        departure_time = None
+    return (origin_city, destination_city, departure_time)
+
+
+def _copy_batch(cur, table: str, columns: tuple, batch: list[tuple]):
+    """Stream one batch through COPY ... FROM STDIN (CSV)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch:
+        *values, embedding = row
+        writer.writerow([*values, format_vector(embedding)])
+    buffer.seek(0)
+
+    query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+    )
+    cur.copy_expert(query.as_string(cur), buffer)
+
+
+def _values_batch(cur, table: str, columns: tuple, batch: list[tuple]):
+    """Fallback: a single multi-row INSERT ... VALUES statement"""
+    query = sql.SQL("INSERT INTO {} ({}) VALUES %s").format(
+        sql.Identifier(table),
+        sql.SQL(", ").join(map(sql.Identifier, columns)),
+    ).as_string(cur)
+    template = "(" + ", ".join(["%s"] * (len(columns) - 1)) + ", %s::vector)"
+    execute_values(
+        cur,
+        query,
+        [(*values, format_vector(embedding)) for *values, embedding in batch],
+        template=template,
+        page_size=len(batch),
+    )
+
+
+def bulk_insert_embeddings(conn, rows: list[tuple], table: str = "documents_embeddings", batch_size: int | None = None) -> dict:
+    """
+    Write embedding rows in batches, one transaction per batch.
+    Each batch goes through COPY first and falls back to a multi-row INSERT;
+    a batch that fails both ways is rolled back and reported, the rest continue.
+
+    rows: tuples ordered like EMBEDDING_COLUMNS (embedding as a float sequence)
+    Before migration 004 the filter values are dropped rather than failing every batch.
+    """
+    batch_size = batch_size or settings.EMBED_WRITE_BATCH_SIZE
+    result = {"inserted": 0, "failed": 0, "errors": []}
+
+    cur = conn.cursor()
+    try:
+        columns = EMBEDDING_COLUMNS if has_hybrid_columns(cur, table) else _LEGACY_COLUMNS
+    finally:
+        cur.close()
+    if columns is _LEGACY_COLUMNS:
+        logger.warning(f"⚠️ {table} has no prefilter columns (migration 004 not applied), writing rows without them")
+        kept = [EMBEDDING_COLUMNS.index(c) for c in columns]
+        rows = [tuple(row[i] for i in kept) for row in rows]
+
+    for batch_no, start in enumerate(range(0, len(rows), batch_size), 1):
+        batch = rows[start:start + batch_size]
+        cur = conn.cursor()
+        try:
+            try:
+                _copy_batch(cur, table, columns, batch)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"⚠️ COPY failed for {table} batch {batch_no}, retrying with INSERT ... VALUES: {e}")
+                _values_batch(cur, table, columns, batch)
+                conn.commit()
+            result["inserted"] += len(batch)
+        except Exception as e:
+            conn.rollback()
+            result["failed"] += len(batch)
+            result["errors"].append({
+                "batch": batch_no,
+                "rows": len(batch),
+                "source_ids": [row[1] for row in batch[:5]],
+                "error": str(e),
+            })
+            logger.error(f"❌ Failed to write {table} batch {batch_no} ({len(batch)} rows): {e}")
+        finally:
+            cur.close()
+
+    return result
+
+
+def _fetch_hashes(conn, table: str, source_table: str) -> dict[str, str | None]:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            sql.SQL("SELECT source_id::text, content_hash FROM {} WHERE source_table = %s").format(sql.Identifier(table)),
+            (source_table,),
+        )
+        return dict(cur.fetchall())
+    finally:
+        cur.close()
+
+
+def sync_source_embeddings(conn, source_table: str, items: list[tuple], encode, table: str = "documents_embeddings") -> dict:
+    """
+    Incrementally bring one source in line with the current data.
+
+    items: (source_id, text_chunk, filters) for every row that should be indexed,
+           filters ordered like FILTER_COLUMNS
+    encode: callable turning a list of texts into a list of vectors
+
+    Only new or changed chunks are embedded. New rows are written before the
+    stale ones are removed, so retrieval never sees a gap for a source_id;
+    a stale row is only deleted once its replacement exists.
+    """
+    existing = _fetch_hashes(conn, table, source_table)
+    current = {
+        str(source_id): (source_id, text_chunk, content_hash(text_chunk), filters)
+        for source_id, text_chunk, filters in items
+    }
+
+    changed = [entry for key, entry in current.items() if existing.get(key) != entry[2]]
+    unchanged = len(current) - len(changed)
+    vanished = [key for key in existing if key not in current]
+
+    result = {"inserted": 0, "failed": 0, "errors": []}
+    if changed:
+        embeddings = encode([text_chunk for _, text_chunk, _, _ in changed])
+        result = bulk_insert_embeddings(
+            conn,
+            [(source_table, source_id, text_chunk, chunk_hash, *filters, embedding)
+             for (source_id, text_chunk, chunk_hash, filters), embedding in zip(changed, embeddings)],
+            table=table,
+        )
+
+    cur = conn.cursor()
+    try:
+        # Superseded versions of changed rows (only where the new version landed)
+        cur.execute(
+            sql.SQL("""
+                DELETE FROM {table} d
+                USING unnest(%s::text[], %s::text[]) AS n(source_id, content_hash)
+                WHERE d.source_table = %s
+                  AND d.source_id::text = n.source_id
+                  AND d.content_hash IS DISTINCT FROM n.content_hash
+                  AND EXISTS (
+                      SELECT 1 FROM {table} fresh
+                      WHERE fresh.source_table = d.source_table
+                        AND fresh.source_id = d.source_id
+                        AND fresh.content_hash = n.content_hash
+                  )
+            """).format(table=sql.Identifier(table)),
+            ([key for key in current], [entry[2] for entry in current.values()], source_table),
+        )
+        replaced = cur.rowcount
+
+        # Rows whose source record disappeared
+        cur.execute(
+            sql.SQL("""
+                DELETE FROM {} 
+                WHERE source_table = %s AND NOT (source_id::text = ANY(%s::text[]))
+            """).format(sql.Identifier(table)),
+            (source_table, list(current)),
+        )
+        removed = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+    result.update({
+        "unchanged": unchanged,
+        "replaced": replaced,
+        "deleted": removed,
+        "changed_ids": [str(source_id) for source_id, _, _, _ in changed] + vanished,
+    })
+    logger.info(
+        f"🔁 {source_table}: {len(changed)} embedded, {unchanged} unchanged, "
+        f"{replaced} replaced, {removed} removed"
+    )
+    return result
@@ -1,4 +1,4 @@
-from app.database import get_connection, return_connection
+from app.database import get_connection, return_connection, get_async_pool
 import uuid
 from typing import List, Dict
 import logging
@@ -73,18 +73,18 @@ class HistoryService:
         conn = get_connection()
         cur = conn.cursor()
         try:
+            # Newest `limit` rows via idx_messages_conversation_created, re-ordered chronologically
             cur.execute("""
-                SELECT role, content 
-                FROM messages 
-                WHERE conversation_id = %s 
-                ORDER BY created_at ASC 
-            """, (conversation_id,))
+                SELECT role, content FROM (
+                    SELECT role, content, created_at
+                    FROM messages 
+                    WHERE conversation_id = %s 
+                    ORDER BY created_at DESC 
+                    LIMIT %s
+                ) recent
+                ORDER BY created_at ASC
+            """, (conversation_id, limit))
             rows = cur.fetchall()
-            
-            # If total messages > limit, take the last 'limit'
-            # (Fetching all and slicing in python is easier for maintaining chronological order)
-            if len(rows) > limit:
-                rows = rows[-limit:]
                 
             return [{"role": r[0], "content": r[1]} for r in rows]
         except Exception as e:
@@ -94,4 +94,93 @@ class HistoryService:
             cur.close()
             return_connection(conn)
 
+    # ---- Combined operations: one round-trip each per chat turn ----
+
+    async def get_conversation_with_history_async(self, user_id: str, limit: int = 10) -> tuple[str, List[Dict]]:
+        """
+        Get-or-create the user's current conversation, bump its activity and
+        fetch its last `limit` messages, all in a single statement.
+        """
+        pool = await get_async_pool()
+        try:
+            async with pool.acquire() as conn:
+                rows = await conn.fetch("""
+                    WITH existing AS (
+                        SELECT id FROM conversations
+                        WHERE user_id = $1
+                        ORDER BY last_activity_at DESC
+                        LIMIT 1
+                    ), touched AS (
+                        UPDATE conversations c SET last_activity_at = NOW()
+                        FROM existing e
+                        WHERE c.id = e.id
+                        RETURNING c.id
+                    ), created AS (
+                        INSERT INTO conversations (id, user_id)
+                        SELECT $2, $1
+                        WHERE NOT EXISTS (SELECT 1 FROM existing)
+                        RETURNING id
+                    ), conv AS (
+                        SELECT id FROM touched
+                        UNION ALL
+                        SELECT id FROM created
+                    )
+                    SELECT conv.id AS conversation_id, m.role, m.content
+                    FROM conv
+                    LEFT JOIN LATERAL (
+                        SELECT role, content, created_at
+                        FROM messages
+                        WHERE conversation_id = conv.id
+                        ORDER BY created_at DESC
+                        LIMIT $3
+                    ) m ON TRUE
+                    ORDER BY m.created_at ASC
+                """, user_id, str(uuid.uuid4()), limit)
+        except Exception as e:
+            logger.error(f"Error in get_conversation_with_history_async: {e}")
+            raise
+
+        conversation_id = str(rows[0]["conversation_id"])
+        history = [{"role": r["role"], "content": r["content"]} for r in rows if r["role"] is not None]
+        return conversation_id, history
+
+    async def add_messages_async(self, conversation_id: str, messages: List[Dict]):
+        """
+        Save several messages (e.g. the user question and the answer) and bump
+        the conversation activity in one statement.
+        """
+        await self.add_message_batches_async([(conversation_id, messages)])
+
+    async def add_message_batches_async(self, batches: List[tuple]):
+        """
+        Save messages for any number of conversations in one statement.
+        batches: (conversation_id, [{"role", "content"}, ...]) pairs.
+        created_at is offset by a microsecond per message so the order is preserved.
+        """
+        conversation_ids, roles, contents = [], [], []
+        for conversation_id, messages in batches:
+            for m in messages:
+                conversation_ids.append(conversation_id)
+                roles.append(m["role"])
+                contents.append(m["content"])
+        if not roles:
+            return
+
+        pool = await get_async_pool()
+        try:
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    WITH inserted AS (
+                        INSERT INTO messages (conversation_id, role, content, created_at)
+                        SELECT m.conversation_id, m.role, m.content, NOW() + m.ord * INTERVAL '1 microsecond'
+                        FROM unnest($1::uuid[], $2::text[], $3::text[])
+                             WITH ORDINALITY AS m(conversation_id, role, content, ord)
+                        RETURNING 1
+                    )
+                    UPDATE conversations SET last_activity_at = NOW() WHERE id = ANY($1::uuid[])
+                """, conversation_ids, roles, contents)
+        except Exception as e:
+            logger.error(f"Error in add_message_batches_async: {e}")
+            raise
+
 history_service = HistoryService()
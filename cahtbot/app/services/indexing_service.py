@@ -1,59 +1,209 @@
 import logging
-from sentence_transformers import SentenceTransformer
+import time
 from app.database import get_connection, return_connection
 from app.config import settings
-from app.services.rag_service import embed_model, load_embedding_model
+from app.services.rag_service import get_embedding_model, encode_batch
+from app.services.embedding_store import bulk_insert_embeddings, sync_source_embeddings, content_hash, filter_values, NO_FILTERS
+from app.services.cache_service import answer_cache
+from app.services.vector_index import ensure_vector_index, drop_vector_indexes
+from app.services.memory_index import memory_index
 
 logger = logging.getLogger(__name__)
 
+REINDEX_MODES = ("shadow", "full", "incremental")
+
+LIVE_TABLE = "documents_embeddings"
+SHADOW_TABLE = "documents_embeddings_shadow"
+PREVIOUS_TABLE = "documents_embeddings_previous"
+
 class IndexingService:
-    def reindex_all(self):
+    def reindex_all(self, mode: str = "shadow", progress=None):
         """
         Re-builds the embeddings for all data in the database.
         This runs the same logic as build_embeddings.py but integrated into the app.
+
+        mode="shadow" builds a complete copy in a staging table and swaps it in
+        atomically; the replaced generation is kept for rollback_generation().
+        mode="full" clears the live table and re-embeds everything in place.
+        mode="incremental" only embeds new/changed chunks (by content hash)
+        and deletes rows whose source disappeared; the table is never emptied.
+
+        progress, if given, receives set_total(rows) once and advance(rows, embedded=...)
+        as work completes (see job_service.ReindexJob).
         """
-        logger.info("♻️ Starting full re-indexing process...")
+        if mode not in REINDEX_MODES:
+            raise ValueError(f"Unknown reindex mode: {mode}")
+
+        logger.info(f"♻️ Starting {mode} re-indexing process...")
         
         # Ensure model is loaded
-        if embed_model is None:
-            logger.info("Embedding model not loaded, loading now...")
-            load_embedding_model()
+        if get_embedding_model() is None:
+            raise RuntimeError("Embedding model is not available")
             
         conn = get_connection()
         try:
-            # 1. Clear old embeddings
-            self._clear_embeddings(conn)
-            
-            # 2. Index Trips
-            trips = self._fetch_trips(conn)
-            self._index_items(conn, trips, "trips")
-            
-            # 3. Index Routes
-            routes = self._fetch_routes(conn)
-            self._index_items(conn, routes, "routes")
-            
-            # 4. Index Policies
-            policies = self._fetch_policies(conn)
-            self._index_items(conn, policies, "cancel_policies")
+            # 1. Fetch every source first so the total amount of work is known
+            sources = [
+                ("trips", self._fetch_trips(conn)),
+                ("routes", self._fetch_routes(conn)),
+                ("cancel_policies", self._fetch_policies(conn)),
+                ("faqs", self._fetch_faqs(conn)),
+            ]
+            if progress:
+                progress.set_total(sum(len(items) for _, items in sources))
+
+            # 2. Prepare the target table
+            target = LIVE_TABLE
+            if mode == "full":
+                self._clear_embeddings(conn)
+            elif mode == "shadow":
+                self._prepare_shadow_table(conn)
+                target = SHADOW_TABLE
+            incremental = mode == "incremental"
             
-            # 5. Index FAQs
-            faqs = self._fetch_faqs(conn)
-            self._index_items(conn, faqs, "faqs")
+            # 3. Index Trips, Routes, Policies and FAQs
+            results = {}
+            for source_table, items in sources:
+                results[source_table] = self._index_items(conn, items, source_table, incremental, target, progress)
             
+            failed = sum(r["failed"] for r in results.values())
+
+            # Build (or bring up to date) the ANN index once the rows are in
+            vector_index = None
+            if not (mode == "shadow" and failed):
+                vector_index = ensure_vector_index(conn, target)
+
+            # 4. Swap the fully built shadow table in (never a partial one)
+            swapped = False
+            if mode == "shadow":
+                if failed:
+                    logger.warning(f"⚠️ {failed} rows failed; keeping the live table and leaving {SHADOW_TABLE} for inspection")
+                else:
+                    self._swap_shadow_table(conn)
+                    swapped = True
+
+            # 5. Cached answers may quote rows that just changed
+            if incremental:
+                answer_cache.invalidate({
+                    (source_table, source_id)
+                    for source_table, result in results.items()
+                    for source_id in result.pop("changed_ids", [])
+                })
+            elif mode == "full" or swapped:
+                answer_cache.invalidate()
+            self._refresh_memory_index()
+
             logger.info("✅ Re-indexing completed successfully!")
-            return {"status": "success", "message": "Re-indexing completed"}
+            return {
+                "status": "success" if not failed else "partial",
+                "mode": mode,
+                "message": "Re-indexing completed",
+                "swapped": swapped,
+                "vector_index": vector_index,
+                "results": results,
+            }
             
         except Exception as e:
+            conn.rollback()
             logger.error(f"❌ Error during re-indexing: {e}")
             raise e
         finally:
             return_connection(conn)
 
+    def rollback_generation(self):
+        """Swap the previous embeddings generation back in (and the current one out)"""
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT to_regclass(%s)", (PREVIOUS_TABLE,))
+            if cur.fetchone()[0] is None:
+                raise ValueError("No previous embeddings generation to roll back to")
+
+            # Rename in one transaction so readers see either generation, never neither
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+            cur.execute(f"ALTER TABLE {LIVE_TABLE} RENAME TO {SHADOW_TABLE}")
+            cur.execute(f"ALTER TABLE {PREVIOUS_TABLE} RENAME TO {LIVE_TABLE}")
+            cur.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO {PREVIOUS_TABLE}")
+            conn.commit()
+            answer_cache.invalidate()
+            self._refresh_memory_index()
+            logger.info("⏪ Rolled back to the previous embeddings generation")
+            return {"status": "success", "message": "Previous generation restored"}
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"❌ Error rolling back embeddings generation: {e}")
+            raise
+        finally:
+            cur.close()
+            return_connection(conn)
+
+    def _refresh_memory_index(self):
+        """Reload the in-process vector matrix (RETRIEVAL_BACKEND=memory) from the new rows"""
+        if settings.RETRIEVAL_BACKEND != "memory":
+            return
+        try:
+            memory_index.refresh()
+        except Exception as e:
+            # The table is already correct; the periodic refresh will retry
+            logger.error(f"❌ Could not refresh the in-memory vector index: {e}")
+
+    def _prepare_shadow_table(self, conn):
+        """Create an empty staging copy of the live table (columns, defaults, non-ANN indexes)"""
+        cur = conn.cursor()
+        try:
+            cur.execute(f"DROP TABLE IF EXISTS {SHADOW_TABLE}")
+            cur.execute(f"CREATE TABLE {SHADOW_TABLE} (LIKE {LIVE_TABLE} INCLUDING ALL)")
+
+            # serial defaults are shared with the live table; detach the sequences
+            # from it so dropping an old generation never drops them
+            cur.execute(
+                """
+                SELECT pg_get_serial_sequence(%s, attname)
+                FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0
+                  AND NOT attisdropped AND attidentity = ''
+                """,
+                (LIVE_TABLE, LIVE_TABLE),
+            )
+            for (sequence,) in cur.fetchall():
+                if sequence:
+                    cur.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+            conn.commit()
+            # The ANN index is built once after the load, not maintained row by row
+            drop_vector_indexes(conn, SHADOW_TABLE)
+            logger.info(f"🧱 Prepared staging table {SHADOW_TABLE}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def _swap_shadow_table(self, conn):
+        """Atomically replace the live table with the shadow; keep the old one as previous"""
+        cur = conn.cursor()
+        try:
+            # The vector index was built after the load; refresh planner
+            # statistics before the table takes traffic
+            cur.execute(f"ANALYZE {SHADOW_TABLE}")
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            cur.execute(f"DROP TABLE IF EXISTS {PREVIOUS_TABLE}")
+            cur.execute(f"ALTER TABLE {LIVE_TABLE} RENAME TO {PREVIOUS_TABLE}")
+            cur.execute(f"ALTER TABLE {SHADOW_TABLE} RENAME TO {LIVE_TABLE}")
+            conn.commit()
+            logger.info(f"🔀 Swapped {SHADOW_TABLE} in; previous generation kept as {PREVIOUS_TABLE}")
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
     def _clear_embeddings(self, conn):
         cur = conn.cursor()
         try:
             cur.execute("DELETE FROM documents_embeddings;")
             conn.commit()
+            drop_vector_indexes(conn, LIVE_TABLE)
             logger.info("🗑️ Cleared old embeddings")
         finally:
             cur.close()
@@ -116,31 +266,50 @@ class IndexingService:
         finally:
             cur.close()
 
-    def _index_items(self, conn, items, source_table):
-        if not items:
+    def _index_items(self, conn, items, source_table, incremental: bool = False, table: str = LIVE_TABLE, progress=None):
+        if not items and not incremental:
             logger.warning(f"No items found for {source_table}")
-            return
+            return {"inserted": 0, "failed": 0, "errors": []}
             
         logger.info(f"Indexing {len(items)} items from {source_table}...")
-        cur = conn.cursor()
-        
-        try:
-            for item in items:
-                text_chunk = self._format_item(item, source_table)
-                embedding = embed_model.encode(text_chunk)
-                embedding_list = embedding.tolist()
-                
-                cur.execute(
-                    """
-                    INSERT INTO documents_embeddings 
-                    (source_table, source_id, text_chunk, embedding)
-                    VALUES (%s, %s, %s, %s)
-                    """,
-                    (source_table, item[0], text_chunk, str(embedding_list))
-                )
-            conn.commit()
-        finally:
-            cur.close()
+        started = time.perf_counter()
+        text_chunks = [self._format_item(item, source_table) for item in items]
+        filters = [self._filter_values(item, source_table) for item in items]
+        on_batch = progress.advance if progress else None
+
+        if incremental:
+            result = sync_source_embeddings(
+                conn, source_table, [(item[0], text_chunk, f) for item, text_chunk, f in zip(items, text_chunks, filters)],
+                lambda texts: encode_batch(texts, on_batch=on_batch),
+                table=table,
+            )
+            if progress:
+                progress.advance(result["unchanged"], embedded=False)
+        else:
+            embeddings = encode_batch(text_chunks, on_batch=on_batch)
+            result = bulk_insert_embeddings(
+                conn,
+                [(source_table, item[0], text_chunk, content_hash(text_chunk), *f, embedding)
+                 for item, text_chunk, f, embedding in zip(items, text_chunks, filters, embeddings)],
+                table=table,
+            )
+
+        elapsed = time.perf_counter() - started
+        logger.info(
+            f"✅ Indexed {result['inserted']}/{len(items)} {source_table} rows in {elapsed:.1f}s "
+            f"({len(items) / elapsed if elapsed else 0:.1f} rows/sec)"
+        )
+        if result["failed"]:
+            logger.warning(f"⚠️ {result['failed']} {source_table} rows failed in {len(result['errors'])} batches")
+        return result
+
+    def _filter_values(self, item, source_table):
+        """Origin/destination city and departure date stored for prefiltering"""
+        if source_table == "trips":
+            return filter_values(item[1], item[2], item[3])
+        elif source_table == "routes":
+            return filter_values(item[1], item[2])
+        return NO_FILTERS
 
     def _format_item(self, item, source_table):
         # Simplified formatting logic based on build_embeddings.py
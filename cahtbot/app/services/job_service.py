@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from app.config import settings
+from app.services.indexing_service import indexing_service
+
+logger = logging.getLogger(__name__)
+
+# Job kind that swaps the previous embeddings generation back in
+ROLLBACK = "rollback"
+
+
+class ReindexJob:
+    """State and progress of one queued re-indexing run (or rollback)"""
+
+    def __init__(self, mode: str):
+        self.id = str(uuid.uuid4())
+        self.mode = mode
+        self.status = "queued"
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.rows_total = 0
+        self.rows_done = 0
+        self.rows_embedded = 0
+        self.result = None
+        self.error = None
+        self.exception = None
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    # Progress protocol used by IndexingService.reindex_all
+    def set_total(self, rows: int):
+        with self._lock:
+            self.rows_total = rows
+
+    def advance(self, rows: int, embedded: bool = True):
+        with self._lock:
+            self.rows_done += rows
+            if embedded:
+                self.rows_embedded += rows
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            rows_per_sec = None
+            eta_seconds = None
+            if self.started_at:
+                end = self.finished_at or datetime.now()
+                elapsed = (end - self.started_at).total_seconds()
+                if elapsed > 0 and self.rows_embedded:
+                    rows_per_sec = round(self.rows_embedded / elapsed, 1)
+                if self.status == "running" and rows_per_sec:
+                    eta_seconds = round(max(self.rows_total - self.rows_done, 0) / rows_per_sec, 1)
+
+            return {
+                "job_id": self.id,
+                "mode": self.mode,
+                "status": self.status,
+                "created_at": self.created_at.isoformat(),
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+                "rows_total": self.rows_total,
+                "rows_done": self.rows_done,
+                "rows_embedded": self.rows_embedded,
+                "rows_per_sec": rows_per_sec,
+                "eta_seconds": eta_seconds,
+                "result": self.result,
+                "error": self.error,
+            }
+
+
+class ReindexJobManager:
+    """
+    Runs re-indexing jobs one at a time on a dedicated low-priority worker
+    thread, so a rebuild neither blocks the request that started it nor
+    competes with chat requests in the default thread pool. Rollbacks go
+    through the same worker, so they never overlap a shadow build or swap.
+    """
+
+    def __init__(self, history_size: int = 20):
+        self._queue = queue.Queue()
+        self._jobs: OrderedDict[str, ReindexJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._history_size = history_size
+        self._worker = None
+
+    def submit(self, mode: str, exclusive: bool = False) -> ReindexJob | None:
+        """
+        Queue a re-index (or ROLLBACK); an identical job that has not started
+        yet is reused. With exclusive, nothing is queued (None is returned)
+        while another job is queued or running.
+        """
+        with self._lock:
+            if exclusive and self._busy():
+                return None
+            for job in self._jobs.values():
+                if job.status == "queued" and job.mode == mode:
+                    return job
+
+            job = ReindexJob(mode)
+            self._jobs[job.id] = job
+            self._trim_history()
+            self._queue.put(job)
+            self._ensure_worker()
+            logger.info(f"📥 Queued {mode} job {job.id}")
+            return job
+
+    def get(self, job_id: str) -> ReindexJob | None:
+        return self._jobs.get(job_id)
+
+    def is_busy(self) -> bool:
+        with self._lock:
+            return self._busy()
+
+    def _busy(self) -> bool:
+        return any(job.status in ("queued", "running") for job in self._jobs.values())
+
+    def list_jobs(self) -> list[dict]:
+        return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def shutdown(self):
+        """Stop the worker after the current job (queued jobs are dropped)"""
+        if self._worker and self._worker.is_alive():
+            self._queue.put(None)
+
+    def _trim_history(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("succeeded", "failed")]
+        while len(self._jobs) > self._history_size and finished:
+            self._jobs.pop(finished.pop(0))
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="reindex-worker", daemon=True)
+            self._worker.start()
+
+    def _lower_priority(self):
+        # On Linux each thread has its own nice value
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), settings.REINDEX_NICENESS)
+        except (AttributeError, OSError) as e:
+            logger.debug(f"Could not lower re-index worker priority: {e}")
+
+    def _run(self):
+        self._lower_priority()
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+
+            job.status = "running"
+            job.started_at = datetime.now()
+            started = time.perf_counter()
+            logger.info(f"▶️ Running {job.mode} job {job.id}")
+            try:
+                if job.mode == ROLLBACK:
+                    job.result = indexing_service.rollback_generation()
+                else:
+                    job.result = indexing_service.reindex_all(job.mode, progress=job)
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(e)
+                job.exception = e
+                job.status = "failed"
+                logger.error(f"❌ {job.mode} job {job.id} failed: {e}")
+            finally:
+                job.finished_at = datetime.now()
+                job.done.set()
+                logger.info(f"⏹️ {job.mode} job {job.id} {job.status} in {time.perf_counter() - started:.1f}s")
+
+
+reindex_jobs = ReindexJobManager()
@@ -0,0 +1,227 @@
+import logging
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from app.config import settings
+from app.database import get_connection, return_connection, parse_vector
+from app.services.embedding_store import has_hybrid_columns
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_BACKENDS = ("pgvector", "memory")
+
+# Changes whenever rows are added, removed, re-embedded or the table is swapped,
+# and (after migration 004) when a row's prefilter values change
+def _fingerprint_sql(filter_columns: bool) -> str:
+    filters = (
+        " || ':' || coalesce(origin_city, '') || ':' || coalesce(destination_city, '')"
+        " || ':' || coalesce(departure_date::text, '')"
+    ) if filter_columns else ""
+    return f"""
+        SELECT count(*), md5(string_agg(
+            source_table || ':' || source_id::text || ':' || coalesce(content_hash, ''){filters},
+            ',' ORDER BY source_table, source_id::text
+        ))
+        FROM documents_embeddings
+    """
+
+
+# Rows upcast from float16 per matmul block
+_FLOAT16_BLOCK = 4096
+
+
+class MemoryVectorIndex:
+    """
+    All of documents_embeddings held in process as one contiguous matrix of
+    unit-length rows, so a search is a single matrix-vector product instead
+    of a database round-trip. Rows are ranked by cosine similarity, which
+    orders results like pgvector's L2 distance for normalized embeddings.
+
+    The matrix and its row metadata are replaced together on refresh(), so a
+    search running concurrently always sees one consistent generation.
+    """
+
+    def __init__(self):
+        self._snapshot = None  # (matrix, documents, columns, fingerprint)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._poller = None
+        self.loaded_at = None
+        self.load_seconds = None
+
+    @property
+    def ready(self) -> bool:
+        return self._snapshot is not None
+
+    def refresh(self, force: bool = True) -> bool:
+        """Reload the matrix from the database; without force only if the table changed"""
+        with self._lock:
+            started = time.perf_counter()
+            conn = get_connection()
+            cur = conn.cursor()
+            try:
+                # Before migration 004 there is nothing to filter on but source_table
+                filter_columns = has_hybrid_columns(cur)
+                cur.execute(_fingerprint_sql(filter_columns))
+                fingerprint = (filter_columns, *cur.fetchone())
+                if not force and self._snapshot is not None and self._snapshot[3] == fingerprint:
+                    return False
+
+                cur.execute(
+                    f"""
+                    SELECT text_chunk, source_table, source_id, embedding::text
+                           {", origin_city, destination_city, departure_date" if filter_columns else ""}
+                    FROM documents_embeddings
+                    """
+                )
+                rows = cur.fetchall()
+            finally:
+                conn.rollback()
+                cur.close()
+                return_connection(conn)
+
+            dtype = np.float16 if settings.MEMORY_INDEX_FLOAT16 else np.float32
+            if rows:
+                matrix = np.array([parse_vector(row[3]) for row in rows], dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix /= np.where(norms == 0, 1, norms)
+                matrix = np.ascontiguousarray(matrix, dtype=dtype)
+            else:
+                matrix = np.empty((0, 0), dtype=dtype)
+            documents = [
+                {"text_chunk": text_chunk, "source_table": source_table, "source_id": source_id}
+                for text_chunk, source_table, source_id, *_ in rows
+            ]
+            # Prefilter columns as arrays so a filter is one vectorized comparison
+            columns = {"source_table": np.array([row[1] for row in rows], dtype=object)}
+            if filter_columns:
+                columns.update({
+                    "origin_city": np.array([row[4] for row in rows], dtype=object),
+                    "destination_city": np.array([row[5] for row in rows], dtype=object),
+                    "departure_date": np.array([row[6] or "NaT" for row in rows], dtype="datetime64[D]"),
+                })
+
+            self._snapshot = (matrix, documents, columns, fingerprint)
+            self.loaded_at = datetime.now()
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            logger.info(f"✅ In-memory vector index loaded: {len(documents)} rows ({matrix.nbytes / 2**20:.1f} MiB) in {self.load_seconds}s")
+            return True
+
+    def _filter_mask(self, columns: dict, filters: dict):
+        """
+        Rows passing the prefilters (same keys as rag_service._filter_clause), or
+        None. Like the pgvector path, city and date filters are ignored before
+        migration 004.
+        """
+        mask = None
+
+        def narrow(condition):
+            nonlocal mask
+            mask = condition if mask is None else mask & condition
+
+        if filters.get("source_tables"):
+            narrow(np.isin(columns["source_table"], list(filters["source_tables"])))
+        if "origin_city" not in columns:
+            return mask
+        for key in ("origin_city", "destination_city"):
+            if filters.get(key):
+                narrow(columns[key] == filters[key])
+        # NaT never compares true, so rows without a date are excluded
+        if filters.get("departure_from"):
+            narrow(columns["departure_date"] >= np.datetime64(filters["departure_from"], "D"))
+        if filters.get("departure_to"):
+            narrow(columns["departure_date"] <= np.datetime64(filters["departure_to"], "D"))
+        return mask
+
+    @staticmethod
+    def _scores(matrix, queries) -> np.ndarray:
+        """Cosine similarity of each query against every row, shape (queries, rows)"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+        if matrix.dtype == np.float32:
+            return queries @ matrix.T
+
+        # No BLAS for float16: upcast a block at a time
+        scores = np.empty((len(queries), len(matrix)), dtype=np.float32)
+        for start in range(0, len(matrix), _FLOAT16_BLOCK):
+            block = matrix[start:start + _FLOAT16_BLOCK]
+            scores[:, start:start + len(block)] = queries @ block.astype(np.float32).T
+        return scores
+
+    def _top_k(self, queries, k: int, filters: dict | None):
+        """(documents, [(row indices, scores)] per query), best first"""
+        matrix, documents, columns, _ = self._snapshot
+        if not documents:
+            return documents, [(np.empty(0, dtype=int), np.empty(0)) for _ in queries]
+
+        scores = self._scores(matrix, queries)
+        mask = self._filter_mask(columns, filters) if filters else None
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+            k = min(k, int(mask.sum()))
+        k = min(k, len(documents))
+        if k == 0:
+            return documents, [(np.empty(0, dtype=int), np.empty(0)) for _ in queries]
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        ranked = []
+        for row_scores, row_top in zip(scores, top):
+            row_top = row_top[np.argsort(-row_scores[row_top])]
+            ranked.append((row_top, row_scores[row_top]))
+        return documents, ranked
+
+    def search(self, query_emb, k: int, filters: dict | None = None) -> list[dict]:
+        """Top-k documents by cosine similarity (same dicts as the pgvector path)"""
+        documents, [(top, _)] = self._top_k([query_emb], k, filters)
+        return [dict(documents[i]) for i in top]
+
+    def search_batch(self, query_embs, k: int, filters: dict | None = None) -> list[list[dict]]:
+        """Top-k for several queries with one matrix product; documents carry their cosine distance"""
+        if not len(query_embs):
+            return []
+        documents, ranked = self._top_k(query_embs, k, filters)
+        return [
+            [{**documents[i], "distance": max(float(1 - score), 0.0)} for i, score in zip(top, scores)]
+            for top, scores in ranked
+        ]
+
+    def start(self):
+        """Load in the background and, if configured, poll the table for changes"""
+        self._stop.clear()
+        self._poller = threading.Thread(target=self._run, name="memory-index-refresh", daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error(f"❌ Could not load the in-memory vector index, using pgvector until it loads: {e}")
+
+        interval = settings.MEMORY_INDEX_REFRESH_INTERVAL
+        while interval > 0 and not self._stop.wait(interval):
+            try:
+                # Picks up re-indexes run by other workers or build_embeddings.py
+                self.refresh(force=False)
+            except Exception as e:
+                logger.warning(f"⚠️ In-memory vector index refresh failed: {e}")
+
+    def stats(self) -> dict:
+        if self._snapshot is None:
+            return {"status": "not_loaded"}
+        matrix, documents, _, _ = self._snapshot
+        return {
+            "status": "loaded",
+            "rows": len(documents),
+            "dtype": str(matrix.dtype),
+            "megabytes": round(matrix.nbytes / 2**20, 2),
+            "loaded_at": self.loaded_at.isoformat(),
+            "load_seconds": self.load_seconds,
+        }
+
+
+memory_index = MemoryVectorIndex()
@@ -0,0 +1,154 @@
+import logging
+from prometheus_client import Counter, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# Stages of a /chat turn, in pipeline order
+CHAT_STAGES = (
+    "conversation_lookup",  # hot conversation cache
+    "history_fetch",        # conversation + history from Postgres on a cache miss
+    "query_rewrite",        # LLM rewrite of a follow-up question
+    "embedding",            # query embedding (cache or embedding executor)
+    "vector_search",        # pgvector / in-memory search
+    "prompt_build",         # token-budgeted messages
+    "llm_call",             # Groq answer (until the last token when streaming)
+    "persistence",          # conversation cache append + message write queue
+)
+
+STAGE_SECONDS = Histogram(
+    "chatbot_stage_duration_seconds",
+    "Latency of each chat pipeline stage",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+for _stage in CHAT_STAGES:
+    STAGE_SECONDS.labels(_stage)
+
+EMBEDDING_QUEUE_WAIT_SECONDS = Histogram(
+    "chatbot_embedding_queue_wait_seconds",
+    "Time an encode request waited in the embedding executor queue",
+    ["priority"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens",
+    "Tokens billed by the Groq API, from the usage field of its responses",
+    ["kind"],
+)
+for _kind in ("prompt", "completion"):
+    LLM_TOKENS.labels(_kind)
+
+
+def stage_timer(stage: str):
+    """Context manager timing one pipeline stage (works across awaits)"""
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def observe_stage(stage: str, seconds: float):
+    """Record a stage duration measured by the caller"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def record_llm_usage(usage: dict | None):
+    """Count prompt/completion tokens from a Groq `usage` object"""
+    if not usage:
+        return
+    LLM_TOKENS.labels("prompt").inc(usage.get("prompt_tokens") or 0)
+    LLM_TOKENS.labels("completion").inc(usage.get("completion_tokens") or 0)
+
+
+class RuntimeCollector:
+    """
+    State that already lives in the services (pool sizes, model load state,
+    cache and executor statistics), read at scrape time instead of being
+    mirrored into gauges on every change.
+    """
+
+    def describe(self):
+        # Nothing to describe up front, so registering does not call collect()
+        return []
+
+    def collect(self):
+        # Imported here: these modules import this one for their own metrics
+        from app import database
+        from app.config import settings
+        from app.services.cache_service import answer_cache
+        from app.services.conversation_cache import conversation_cache
+        from app.services.embedding_executor import embedding_executor, PRIORITY_NAMES
+        from app.services.memory_index import memory_index
+        from app.services.rag_service import query_embedding_cache
+        from app.services.startup_service import model_startup
+
+        connections = GaugeMetricFamily(
+            "chatbot_db_pool_connections", "Database pool connections by state", labels=["pool", "state"],
+        )
+        if database.async_pool is not None:
+            pool = database.async_pool
+            connections.add_metric(["async", "in_use"], pool.get_size() - pool.get_idle_size())
+            connections.add_metric(["async", "idle"], pool.get_idle_size())
+            connections.add_metric(["async", "max"], pool.get_max_size())
+        if database.connection_pool is not None:
+            pool = database.connection_pool
+            connections.add_metric(["sync", "in_use"], len(pool._used))
+            connections.add_metric(["sync", "idle"], len(pool._pool))
+            connections.add_metric(["sync", "max"], pool.maxconn)
+        yield connections
+
+        model_state = GaugeMetricFamily(
+            "chatbot_embedding_model_state", "1 for the current embedding model load state",
+            labels=["state", "backend"],
+        )
+        for state in ("not_started", "loading", "ready", "failed"):
+            model_state.add_metric([state, settings.EMBED_BACKEND], 1 if model_startup.status == state else 0)
+        yield model_state
+        for name, seconds in model_startup.timings.items():
+            yield GaugeMetricFamily(
+                f"chatbot_startup_{name}", f"Cold start: {name.replace('_', ' ')}", value=seconds,
+            )
+
+        hits = CounterMetricFamily("chatbot_cache_hits", "Cache hits", labels=["cache"])
+        misses = CounterMetricFamily("chatbot_cache_misses", "Cache misses", labels=["cache"])
+        ratio = GaugeMetricFamily("chatbot_cache_hit_ratio", "Cache hits / lookups since start", labels=["cache"])
+        caches = {
+            "query_embedding": query_embedding_cache.stats(),
+            "answer": answer_cache.stats(),
+            "conversation": conversation_cache.stats(),
+        }
+        for cache, stats in caches.items():
+            if "hits" not in stats:
+                continue
+            hits.add_metric([cache], stats["hits"])
+            misses.add_metric([cache], stats["misses"])
+            lookups = stats["hits"] + stats["misses"]
+            ratio.add_metric([cache], stats["hits"] / lookups if lookups else 0.0)
+        yield hits
+        yield misses
+        yield ratio
+
+        executor = embedding_executor.stats()
+        yield GaugeMetricFamily(
+            "chatbot_embedding_queue_depth", "Encode requests waiting in the embedding executor",
+            value=executor["queue_depth"],
+        )
+        batches = CounterMetricFamily(
+            "chatbot_embedding_batches", "encode() calls made by the embedding executor", labels=["priority"],
+        )
+        rejected = CounterMetricFamily(
+            "chatbot_embedding_rejected", "Encode requests rejected because the queue was full", labels=["priority"],
+        )
+        for priority in PRIORITY_NAMES.values():
+            batches.add_metric([priority], executor[priority]["batches"])
+            rejected.add_metric([priority], executor[priority]["rejected"])
+        yield batches
+        yield rejected
+
+        if settings.RETRIEVAL_BACKEND == "memory":
+            yield GaugeMetricFamily(
+                "chatbot_memory_index_rows", "Rows in the in-memory vector index (0 until loaded)",
+                value=memory_index.stats().get("rows", 0),
+            )
+
+
+REGISTRY.register(RuntimeCollector())
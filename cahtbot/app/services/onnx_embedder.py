@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import numpy as np
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EMBED_BACKENDS = ("torch", "onnx")
+
+_CONFIG_FILE = "embedder.json"
+_POOLING_MODES = ("cls", "mean", "max", "mean_sqrt_len_tokens")
+
+# Parity texts: the kind of questions and chunks the chatbot embeds
+PARITY_TEXTS = [
+    "ما هي الرحلات المتاحة من صنعاء إلى عدن غداً؟",
+    "كم سعر التذكرة إلى تعز؟",
+    "ما هي سياسة الإلغاء واسترداد المبلغ؟",
+    "رحلة متاحة من صنعاء إلى عدن.\nالشركة: النقل الجماعي.\nموعد الانطلاق: 2026-01-05 08:00.\nالسعر: 5000 ريال.",
+    "هل يمكنني تغيير موعد الحجز بعد الدفع؟",
+    "Is there a bus from Sanaa to Aden tonight?",
+]
+
+
+def onnx_model_dir(model_name: str | None = None) -> str:
+    """Export directory of a model under EMBED_ONNX_DIR"""
+    model_name = model_name or settings.EMBED_MODEL_NAME
+    return os.path.join(settings.EMBED_ONNX_DIR, model_name.replace("/", "__"))
+
+
+class OnnxEmbedder:
+    """
+    A SentenceTransformer exported by export_onnx(), served through ONNX
+    Runtime on CPU. encode() takes the arguments the app passes to
+    SentenceTransformer.encode() and returns the same embeddings (within
+    quantization error), without loading torch.
+    """
+
+    def __init__(self, model_dir: str, quantized: bool | None = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        with open(os.path.join(model_dir, _CONFIG_FILE), encoding="utf-8") as f:
+            self.config = json.load(f)
+        quantized = settings.EMBED_ONNX_QUANTIZE if quantized is None else quantized
+        if quantized and not self.config["quantized"]:
+            raise FileNotFoundError(f"No int8 model in {model_dir}; export without --no-quantize")
+
+        self.quantized = quantized
+        self.model_path = os.path.join(model_dir, "model.int8.onnx" if quantized else "model.onnx")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.max_seq_length = self.config["max_seq_length"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        mode = self.config["pooling"]
+        if mode == "cls":
+            return token_embeddings[:, 0]
+
+        mask = attention_mask[..., None].astype(np.float32)
+        if mode == "max":
+            return np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        return summed / (np.sqrt(counts) if mode == "mean_sqrt_len_tokens" else counts)
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        tokens = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np",
+        )
+        feed = {name: tokens[name].astype(np.int64) for name in self._input_names}
+        token_embeddings = self.session.run(None, feed)[0]
+        embeddings = self._pool(token_embeddings, tokens["attention_mask"])
+        if self.config["normalize"]:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, convert_to_numpy: bool = True, **kwargs):
+        """Same call shape as SentenceTransformer.encode (always returns NumPy)"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        # Longest first, like SentenceTransformer, so each batch pads to similar lengths
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            batch = order[start:start + batch_size]
+            embeddings[batch] = self._encode_batch([texts[i] for i in batch])
+        return embeddings[0] if single else embeddings
+
+
+def parity(reference, candidate, texts: list[str] = PARITY_TEXTS) -> dict:
+    """Cosine similarity between two encoders' embeddings of the same texts"""
+    a = np.asarray(reference.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    b = np.asarray(candidate.encode(texts, convert_to_numpy=True), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min_cosine": round(float(cosine.min()), 5), "mean_cosine": round(float(cosine.mean()), 5)}
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True, opset: int = 14) -> dict:
+    """
+    Export a SentenceTransformer (transformer + pooling [+ normalize]) to
+    ONNX in output_dir, optionally with a dynamically int8-quantized copy,
+    and check both against the torch embeddings.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Transformer, Pooling, Normalize
+
+    model = SentenceTransformer(model_name, device="cpu")
+    modules = list(model)
+    transformer, pooling = modules[0], modules[1] if len(modules) > 1 else None
+    if (
+        not isinstance(transformer, Transformer)
+        or not isinstance(pooling, Pooling)
+        or any(not isinstance(m, Normalize) for m in modules[2:])
+    ):
+        raise ValueError(f"{model_name}: only Transformer + Pooling [+ Normalize] models can be exported")
+    pooling_mode = pooling.get_pooling_mode_str()
+    if pooling_mode not in _POOLING_MODES:
+        raise ValueError(f"{model_name}: unsupported pooling mode {pooling_mode}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(output_dir)
+
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in tokenizer.model_input_names]
+    sample = tokenizer(PARITY_TEXTS[:2], padding=True, return_tensors="pt")
+    auto_model = transformer.auto_model.eval()
+
+    class _TokenEmbeddings(torch.nn.Module):
+        def forward(self, *inputs):
+            return auto_model(**dict(zip(input_names, inputs)), return_dict=False)[0]
+
+    model_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _TokenEmbeddings(),
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in input_names + ["token_embeddings"]},
+            opset_version=opset,
+        )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(model_path, os.path.join(output_dir, "model.int8.onnx"), weight_type=QuantType.QInt8)
+
+    with open(os.path.join(output_dir, _CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": pooling_mode,
+            "normalize": len(modules) > 2,
+            "max_seq_length": model.max_seq_length,
+            "dimension": model.get_sentence_embedding_dimension(),
+            "quantized": quantize,
+        }, f, indent=2)
+
+    result = {"output_dir": output_dir, "fp32": parity(model, OnnxEmbedder(output_dir, quantized=False))}
+    if quantize:
+        result["int8"] = parity(model, OnnxEmbedder(output_dir, quantized=True))
+    return result
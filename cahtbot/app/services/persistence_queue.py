@@ -0,0 +1,131 @@
+import asyncio
+import logging
+from app.config import settings
+from app.services.history_service import history_service
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWriteQueue:
+    """
+    Write-behind persistence for chat messages.
+
+    submit() hands the messages of a turn to an in-memory queue and returns;
+    a background task drains the queue and writes up to PERSIST_BATCH_SIZE
+    turns per statement. The queue is bounded: when it is full, submit()
+    waits for space, so a slow database slows producers down instead of
+    growing memory. Turns are never written around the queue, which keeps
+    each conversation's messages in order.
+
+    Until a turn is flushed, a history read from Postgres does not see it;
+    pending() / with_pending() let the reader add those messages back.
+    """
+
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+        # conversation_id -> messages queued or being written, oldest first.
+        # Tuples are replaced, never mutated, so dict(self._pending) is a snapshot.
+        self._pending: dict[str, tuple] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def start(self):
+        """Start the background writer (called on startup)"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=settings.PERSIST_QUEUE_SIZE)
+        self._worker = asyncio.create_task(self._run(), name="message-write-behind")
+        logger.info("✅ Message write-behind queue started")
+
+    async def submit(self, conversation_id: str, messages: list[dict]):
+        """Queue the messages of one turn for persistence"""
+        if not self.running:
+            await history_service.add_messages_async(conversation_id, messages)
+            return
+
+        if self._queue.full():
+            logger.warning("⚠️ Write-behind queue full, waiting for the writer")
+        await self._queue.put((conversation_id, messages))
+        # No await since the put: the writer cannot have taken the item yet
+        self._pending[conversation_id] = self._pending.get(conversation_id, ()) + tuple(messages)
+
+    def pending(self) -> dict[str, tuple]:
+        """Messages not yet written, per conversation; take it before reading history"""
+        return dict(self._pending)
+
+    @staticmethod
+    def with_pending(history: list[dict], pending: tuple) -> list[dict]:
+        """
+        history (read from Postgres) followed by the pending messages it does
+        not already end with (a flush may have landed before the read).
+        """
+        for overlap in range(min(len(history), len(pending)), 0, -1):
+            if history[-overlap:] == list(pending[:overlap]):
+                break
+        else:
+            overlap = 0
+        return history + list(pending[overlap:])
+
+    async def stop(self):
+        """Flush everything still queued, then stop the writer (called on shutdown)"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=settings.PERSIST_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"❌ Shutdown drain timed out with {self.depth()} turns still queued")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        logger.info("Message write-behind queue stopped")
+
+    async def _next_batch(self) -> list[tuple]:
+        """Wait for one item, then collect more for up to PERSIST_FLUSH_INTERVAL"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.PERSIST_FLUSH_INTERVAL
+        while len(batch) < settings.PERSIST_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: list[tuple]):
+        for attempt in range(1, settings.PERSIST_MAX_RETRIES + 1):
+            try:
+                await history_service.add_message_batches_async(batch)
+                return
+            except Exception as e:
+                logger.warning(f"⚠️ Write-behind flush of {len(batch)} turns failed (attempt {attempt}): {e}")
+                await asyncio.sleep(0.5 * attempt)
+        logger.error(f"❌ Dropping {len(batch)} turns after {settings.PERSIST_MAX_RETRIES} failed flushes")
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for conversation_id, messages in batch:
+                    remaining = self._pending.get(conversation_id, ())[len(messages):]
+                    if remaining:
+                        self._pending[conversation_id] = remaining
+                    else:
+                        self._pending.pop(conversation_id, None)
+                    self._queue.task_done()
+
+
+message_write_queue = MessageWriteQueue()
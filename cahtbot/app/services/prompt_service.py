@@ -0,0 +1,89 @@
+import logging
+import math
+from app.config import settings
+from app.services.cache_service import normalize_query
+from app.services.llm_service import build_system_prompt
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate for budgeting (no tokenizer round-trip).
+    PROMPT_CHARS_PER_TOKEN is deliberately low for Arabic text, so budgets
+    err on the side of a shorter prompt.
+    """
+    return math.ceil(len(text) / settings.PROMPT_CHARS_PER_TOKEN) if text else 0
+
+
+def _word_set(text: str) -> frozenset:
+    return frozenset(normalize_query(text).split())
+
+
+def dedupe_chunks(chunks: list[str], threshold: float | None = None) -> list[str]:
+    """
+    Drop chunks whose word overlap (Jaccard) with an earlier, better-ranked
+    chunk is at least threshold. Trips that differ in time or price stay
+    apart; repeated or near-verbatim chunks are sent once.
+    """
+    threshold = settings.PROMPT_DEDUP_SIMILARITY if threshold is None else threshold
+    kept, kept_words = [], []
+    for chunk in chunks:
+        words = _word_set(chunk)
+        if any(len(words & seen) / (len(words | seen) or 1) >= threshold for seen in kept_words):
+            continue
+        kept.append(chunk)
+        kept_words.append(words)
+    return kept
+
+
+def fit_chunks(chunks: list[str], budget: int) -> list[str]:
+    """Keep chunks in rank order while they fit the token budget (larger ones are skipped)"""
+    kept, used = [], 0
+    for chunk in chunks:
+        tokens = estimate_tokens(chunk)
+        if used + tokens > budget:
+            continue
+        kept.append(chunk)
+        used += tokens
+    return kept
+
+
+def trim_history(history: list[dict], budget: int) -> list[dict]:
+    """The most recent messages that fit the token budget, starting with a user turn"""
+    kept, used = [], 0
+    for message in reversed(history):
+        used += estimate_tokens(message["content"])
+        if used > budget:
+            break
+        kept.append(message)
+    kept.reverse()
+    # An answer without its question only confuses the model
+    while kept and kept[0]["role"] != "user":
+        kept.pop(0)
+    return kept
+
+
+def select_context(context_chunks: list[str]) -> list[str]:
+    """The retrieved chunks that go into the prompt: deduplicated, within PROMPT_CONTEXT_TOKENS"""
+    return fit_chunks(dedupe_chunks(context_chunks), settings.PROMPT_CONTEXT_TOKENS)
+
+
+def build_messages(context_chunks: list[str], history: list[dict], message: str) -> tuple[list[dict], list[str]]:
+    """
+    Chat messages for the LLM: system prompt with the selected context (see
+    select_context), the history within PROMPT_HISTORY_TOKENS, then the
+    user's message. Also returns the context chunks that were used.
+    """
+    context = select_context(context_chunks)
+    recent = trim_history(history, settings.PROMPT_HISTORY_TOKENS)
+
+    messages = [{"role": "system", "content": build_system_prompt(context)}]
+    messages.extend(recent)
+    messages.append({"role": "user", "content": message})
+
+    logger.debug(
+        f"Prompt ~{sum(estimate_tokens(m['content']) for m in messages)} tokens: "
+        f"{len(context)}/{len(context_chunks)} chunks, {len(recent)}/{len(history)} history messages"
+    )
+    return messages, context
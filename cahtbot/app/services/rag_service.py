@@ -1,75 +1,393 @@
 import logging
-from sentence_transformers import SentenceTransformer
+import os
+import threading
+import time
 from app.config import settings
-from app.database import get_connection
+from app.database import get_async_pool, format_vector
+from app.services.cache_service import TTLCache, normalize_query
+from app.services.vector_index import search_overrides
+from app.services.memory_index import memory_index
+from app.services.embedding_executor import embedding_executor, REINDEX
+from app.services.startup_service import model_startup
+from app.services.metrics_service import stage_timer
+from app.services.embedding_store import HYBRID_COLUMNS
 
 logger = logging.getLogger(__name__)
 
 # Global variable for the model
 embed_model = None
 
+# Query text -> embedding; repeated questions skip the transformer forward pass
+query_embedding_cache = TTLCache(settings.QUERY_CACHE_SIZE, settings.QUERY_CACHE_TTL)
+
+_model_lock = threading.Lock()
+
+
+def model_snapshot_dir(model_name: str | None = None) -> str:
+    """Pinned local copy of a model under EMBED_MODEL_DIR (written by download_model.py)"""
+    model_name = model_name or settings.EMBED_MODEL_NAME
+    return os.path.join(settings.EMBED_MODEL_DIR, model_name.replace("/", "__"))
+
+
 def load_embedding_model():
     global embed_model
     if embed_model is not None:
         return
+    # The startup warm-up, the embedding executor and indexing may all ask at once
+    with _model_lock:
+        if embed_model is None:
+            embed_model = _load_model()
+
+
+def _load_model():
+    if settings.EMBED_BACKEND == "onnx":
+        from app.services.onnx_embedder import OnnxEmbedder, onnx_model_dir
+        model_dir = onnx_model_dir()
+        logger.info(f"Loading ONNX embedding model: {model_dir} (int8: {settings.EMBED_ONNX_QUANTIZE})")
+        try:
+            model = OnnxEmbedder(model_dir)
+            logger.info("✅ ONNX embedding model loaded successfully")
+            return model
+        except Exception as e:
+            logger.error(f"❌ Error loading ONNX embedding model, falling back to torch: {e}")
 
-    logger.info(f"Loading embedding model: {settings.EMBED_MODEL_NAME}")
+    if settings.EMBED_MODEL_OFFLINE:
+        # Read by huggingface_hub when it is first imported: never contact the hub
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+        os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+    # torch is only imported when the torch backend is actually used
+    from sentence_transformers import SentenceTransformer
+
+    snapshot = model_snapshot_dir()
+    if os.path.isdir(snapshot):
+        source, options = snapshot, {}
+    else:
+        source = settings.EMBED_MODEL_NAME
+        options = {"revision": settings.EMBED_MODEL_REVISION} if settings.EMBED_MODEL_REVISION else {}
+
+    logger.info(f"Loading embedding model: {source}")
     try:
-        # Try loading with local files only first if possible, or just standard load
-        # We can pass local_files_only=False (default) but let's try to be robust
-        embed_model = SentenceTransformer(settings.EMBED_MODEL_NAME)
+        model = SentenceTransformer(source, **options)
         logger.info("✅ Embedding model loaded successfully")
+        return model
     except Exception as e:
         logger.error(f"❌ Error loading primary embedding model: {e}")
         try:
             logger.info("⚠️ Falling back to multilingual model (fallback)...")
-            embed_model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
+            model = SentenceTransformer("sentence-transformers/paraphrase-multilingual-mpnet-base-v2")
             logger.info("✅ Fallback embedding model loaded successfully")
+            return model
         except Exception as e2:
              logger.error(f"❌ CRITICAL: Could not load any embedding model. RAG will not work. Error: {e2}")
-             embed_model = None
+             return None
 
 # Initial load attempt (can be called from main.py startup event)
 # We don't call it here to avoid blocking import
 
+def get_embedding_model():
+    """Return the loaded embedding model, loading it on first use"""
+    if embed_model is None:
+        load_embedding_model()
+    return embed_model
 
-def retrieve_context(query_text: str, k: int = 5) -> list[str]:
+def encode_batch(texts: list[str], model=None, batch_size: int | None = None, workers: int | None = None, on_batch=None):
     """
-    Retrieve top k context chunks using semantic search
+    Encode many texts with batched forward passes.
+    Batches go through the embedding executor at re-index priority, one at a
+    time, so online queries are served in between.
+    With workers > 1 the texts are spread over a SentenceTransformer
+    multi-process pool (one CPU process per worker) instead.
+    on_batch(n) is called after every encoded batch with its size.
     """
-    try:
-        if embed_model is None:
-            load_embedding_model()
-            
-        if embed_model is None:
-            logger.warning("Embedding model not available. Returning empty context.")
-            return []
+    model = model or get_embedding_model()
+    batch_size = batch_size or settings.EMBED_BATCH_SIZE
+    workers = workers or settings.EMBED_WORKERS
 
-        query_emb = embed_model.encode(query_text)
-        embedding_str = "[" + ",".join(str(float(x)) for x in query_emb) + "]"
-
-        from app.database import get_connection, return_connection
-        conn = get_connection()
-        cur = conn.cursor()
-        
+    # Multi-process pools are a SentenceTransformer feature (not available for ONNX)
+    if workers > 1 and len(texts) > batch_size and hasattr(model, "start_multi_process_pool"):
+        mp_pool = model.start_multi_process_pool(target_devices=["cpu"] * workers)
         try:
-            cur.execute(
-                """
-                SELECT text_chunk, source_table, source_id
-                FROM documents_embeddings
-                ORDER BY embedding <-> %s::vector
-                LIMIT %s;
-                """,
-                (embedding_str, k),
-            )
-            rows = cur.fetchall()
-            
-            logger.info(f"Retrieved {len(rows)} context chunks for query: {query_text[:50]}...")
-            return [r[0] for r in rows]
+            embeddings = model.encode_multi_process(texts, mp_pool, batch_size=batch_size)
         finally:
-            cur.close()
-            return_connection(conn)
-    
-    except Exception as e:
-        logger.error(f"Error retrieving context: {e}")
+            model.stop_multi_process_pool(mp_pool)
+        if on_batch:
+            on_batch(len(texts))
+        return embeddings
+
+    embeddings = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        embeddings.extend(embedding_executor.encode(batch, REINDEX, model=model, batch_size=batch_size))
+        if on_batch:
+            on_batch(len(batch))
+    return embeddings
+
+
+async def embed_query_async(query_text: str):
+    """Embed a search query, served from query_embedding_cache when possible; the forward pass runs on the embedding executor"""
+    with stage_timer("embedding"):
+        key = normalize_query(query_text)
+        query_emb = query_embedding_cache.get(key)
+        if query_emb is None:
+            query_emb = (await embedding_executor.encode_async([query_text]))[0]
+            query_embedding_cache.set(key, query_emb)
+        return query_emb
+
+
+async def embed_queries_async(query_texts: list[str]) -> list:
+    """
+    Embed several search queries; the ones not in query_embedding_cache are
+    encoded together in a single forward pass on the embedding executor.
+    """
+    with stage_timer("embedding"):
+        keys = [normalize_query(text) for text in query_texts]
+        embeddings = [query_embedding_cache.get(key) for key in keys]
+        missing = [i for i, emb in enumerate(embeddings) if emb is None]
+        if missing:
+            encoded = await embedding_executor.encode_async([query_texts[i] for i in missing])
+            for i, emb in zip(missing, encoded):
+                embeddings[i] = emb
+                query_embedding_cache.set(keys[i], emb)
+        return embeddings
+
+
+def _use_memory_index() -> bool:
+    """RETRIEVAL_BACKEND=memory, once the matrix is loaded (pgvector until then)"""
+    return settings.RETRIEVAL_BACKEND == "memory" and memory_index.ready
+
+
+# Whether documents_embeddings has the migration 004 columns, and when that was
+# checked; a negative result is re-checked so applying 004 needs no restart
+_hybrid_columns: tuple[bool, float] | None = None
+HYBRID_COLUMNS_RECHECK_SECONDS = 60
+
+
+async def _has_hybrid_columns(conn) -> bool:
+    """
+    Until migration 004 is applied retrieval falls back to plain vector
+    search and only the source_tables filter is applied.
+    """
+    global _hybrid_columns
+    now = time.monotonic()
+    if _hybrid_columns is None or (not _hybrid_columns[0] and now - _hybrid_columns[1] >= HYBRID_COLUMNS_RECHECK_SECONDS):
+        found = await conn.fetchval(
+            """
+            SELECT count(*) FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'documents_embeddings'
+              AND column_name = ANY($1::text[])
+            """,
+            list(HYBRID_COLUMNS),
+        )
+        present = found == len(HYBRID_COLUMNS)
+        if not present and _hybrid_columns is None:
+            logger.warning(
+                "⚠️ documents_embeddings has no hybrid retrieval columns (run python apply_migrations.py): "
+                "using vector search only and ignoring city/date filters"
+            )
+        elif present and _hybrid_columns is not None:
+            logger.info("✅ Hybrid retrieval columns found (migration 004 applied)")
+        _hybrid_columns = (present, now)
+    return _hybrid_columns[0]
+
+
+def _ann_rows(rows: int, filters: dict | None) -> int:
+    """
+    Rows the ANN index must produce for a search returning `rows`. HNSW
+    stops at ef_search candidates before the WHERE clause runs, so a
+    filtered search over-fetches FILTERED_SEARCH_OVERFETCH times as many.
+    """
+    return rows * settings.FILTERED_SEARCH_OVERFETCH if filters else rows
+
+
+def _filter_clause(filters: dict | None, params: list, hybrid_columns: bool = True) -> str:
+    """
+    SQL condition for the structured prefilters; values are appended to params.
+    filters may contain source_tables, origin_city, destination_city,
+    departure_from and departure_to (the last four need hybrid_columns).
+    """
+    filters = filters or {}
+    clauses = []
+
+    def param(value) -> str:
+        params.append(value)
+        return f"${len(params)}"
+
+    if filters.get("source_tables"):
+        clauses.append(f"source_table = ANY({param(list(filters['source_tables']))}::text[])")
+    if not hybrid_columns:
+        return " AND ".join(clauses) or "TRUE"
+    if filters.get("origin_city"):
+        clauses.append(f"origin_city = {param(filters['origin_city'])}")
+    if filters.get("destination_city"):
+        clauses.append(f"destination_city = {param(filters['destination_city'])}")
+    if filters.get("departure_from"):
+        clauses.append(f"departure_date >= {param(filters['departure_from'])}")
+    if filters.get("departure_to"):
+        clauses.append(f"departure_date <= {param(filters['departure_to'])}")
+    return " AND ".join(clauses) or "TRUE"
+
+
+async def _vector_search(conn, query_emb, k: int, filters: dict | None, hybrid_columns: bool = True):
+    params = [format_vector(query_emb), k]
+    where = _filter_clause(filters, params, hybrid_columns)
+    return await conn.fetch(
+        f"""
+        SELECT text_chunk, source_table, source_id
+        FROM documents_embeddings
+        WHERE {where}
+        ORDER BY embedding <-> $1::vector
+        LIMIT $2;
+        """,
+        *params,
+    )
+
+
+async def _hybrid_search(conn, query_emb, query_text: str, k: int, filters: dict | None):
+    """
+    Reciprocal-rank fusion of two rankings over the same prefiltered rows:
+    vector distance and lexical match (full-text rank plus trigram word
+    similarity, so partial Arabic word forms still count). Each ranking
+    contributes HYBRID_CANDIDATES rows; score = sum of 1 / (HYBRID_RRF_K + rank).
+    """
+    params = [format_vector(query_emb), normalize_query(query_text), settings.HYBRID_CANDIDATES, settings.HYBRID_RRF_K, k]
+    where = _filter_clause(filters, params)
+    return await conn.fetch(
+        f"""
+        WITH vector_ranked AS (
+            SELECT text_chunk, source_table, source_id,
+                   row_number() OVER (ORDER BY embedding <-> $1::vector) AS rank
+            FROM documents_embeddings
+            WHERE {where}
+            ORDER BY embedding <-> $1::vector
+            LIMIT $3
+        ),
+        lexical_ranked AS (
+            SELECT text_chunk, source_table, source_id,
+                   row_number() OVER (
+                       ORDER BY ts_rank_cd(text_search, q.query) + word_similarity($2, text_chunk) DESC
+                   ) AS rank
+            FROM documents_embeddings,
+                 -- any of the words, not all of them
+                 (SELECT replace(plainto_tsquery('simple', $2)::text, '&', '|')::tsquery AS query) q
+            WHERE {where} AND (text_search @@ q.query OR $2 <% text_chunk)
+            ORDER BY rank
+            LIMIT $3
+        ),
+        ranked AS (
+            SELECT * FROM vector_ranked
+            UNION ALL
+            SELECT * FROM lexical_ranked
+        )
+        SELECT text_chunk, source_table, source_id
+        FROM ranked
+        GROUP BY text_chunk, source_table, source_id
+        ORDER BY sum(1.0 / ($4 + rank)) DESC
+        LIMIT $5;
+        """,
+        *params,
+    )
+
+
+async def _with_search_overrides(conn, overrides: dict, search, *args):
+    """
+    Run search(*args) on conn. Pooled connections already carry the default
+    ef_search/probes; only a search for more rows than ef_search needs
+    transaction-local settings.
+    """
+    if not overrides:
+        return await search(*args)
+    async with conn.transaction():
+        for name, value in overrides.items():
+            await conn.execute("SELECT set_config($1, $2, true)", name, value)
+        return await search(*args)
+
+
+async def retrieve_documents_async(query_text: str, k: int = 5, filters: dict | None = None):
+    """
+    Async retrieval: the search runs on the asyncpg pool so the event loop is
+    free while Postgres works. With RETRIEVAL_HYBRID the vector ranking is
+    fused with a lexical one (see _hybrid_search); filters (see _filter_clause)
+    narrow the candidate rows before either ranking.
+    Returns (query_embedding, documents) where each document is a dict with
+    text_chunk, source_table and source_id; the embedding is None if the
+    model is unavailable.
+    """
+    # Loading belongs to the startup warm-up, never to the request path
+    if not await model_startup.wait_ready(settings.EMBED_READY_TIMEOUT):
+        logger.warning("Embedding model not ready. Returning empty context.")
+        return None, []
+
+    query_emb = await embed_query_async(query_text)
+
+    if _use_memory_index():
+        # A few thousand rows: the matmul is cheaper than a network round-trip
+        with stage_timer("vector_search"):
+            documents = memory_index.search(query_emb, k, filters)
+        logger.info(f"Retrieved {len(documents)} context chunks (in-memory) for query: {query_text[:50]}...")
+        return query_emb, documents
+
+    with stage_timer("vector_search"):
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            columns = await _has_hybrid_columns(conn)
+            if settings.RETRIEVAL_HYBRID and columns:
+                overrides = search_overrides(_ann_rows(settings.HYBRID_CANDIDATES, filters))
+                rows = await _with_search_overrides(
+                    conn, overrides, _hybrid_search, conn, query_emb, query_text, k, filters,
+                )
+            else:
+                overrides = search_overrides(_ann_rows(k, filters))
+                rows = await _with_search_overrides(conn, overrides, _vector_search, conn, query_emb, k, filters, columns)
+
+    logger.info(f"Retrieved {len(rows)} context chunks for query: {query_text[:50]}...")
+    return query_emb, [dict(r) for r in rows]
+
+
+async def retrieve_documents_batch_async(query_texts: list[str], k: int = 5, filters: dict | None = None) -> list[list[dict]]:
+    """
+    Vector search for many queries at once: one encode call for all of them
+    and one SQL round-trip (a LATERAL top-k per unnested query vector).
+    Returns one list per query, in input order; each document also carries its
+    distance (L2 for pgvector, cosine distance for the in-memory backend).
+    Hybrid ranking is not applied.
+    """
+    if not query_texts:
         return []
+    if not await model_startup.wait_ready(settings.EMBED_READY_TIMEOUT):
+        logger.warning("Embedding model not ready. Returning empty context.")
+        return [[] for _ in query_texts]
+
+    query_embs = await embed_queries_async(query_texts)
+
+    if _use_memory_index():
+        with stage_timer("vector_search"):
+            return memory_index.search_batch(query_embs, k, filters)
+
+    params = [[format_vector(emb) for emb in query_embs], k]
+    with stage_timer("vector_search"):
+        pool = await get_async_pool()
+        async with pool.acquire() as conn:
+            where = _filter_clause(filters, params, await _has_hybrid_columns(conn))
+            query = f"""
+                SELECT q.ord, d.text_chunk, d.source_table, d.source_id, d.distance
+                FROM unnest($1::text[]) WITH ORDINALITY AS q(query_vector, ord)
+                CROSS JOIN LATERAL (
+                    SELECT text_chunk, source_table, source_id,
+                           embedding <-> q.query_vector::vector AS distance
+                    FROM documents_embeddings
+                    WHERE {where}
+                    ORDER BY embedding <-> q.query_vector::vector
+                    LIMIT $2
+                ) d
+                ORDER BY q.ord, d.distance;
+            """
+            overrides = search_overrides(_ann_rows(k, filters))
+            rows = await _with_search_overrides(conn, overrides, conn.fetch, query, *params)
+
+    results = [[] for _ in query_texts]
+    for row in rows:
+        document = dict(row)
+        results[document.pop("ord") - 1].append(document)
+    logger.info(f"Retrieved context chunks for {len(query_texts)} queries in one batch")
+    return results
+
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import threading
+import time
+from app.config import settings
+from app.exceptions import ModelException
+from app.services.embedding_executor import embedding_executor
+
+logger = logging.getLogger(__name__)
+
+_IMPORTED_AT = time.time()
+
+# First forward pass allocates buffers and warms kernels; do it before traffic
+WARMUP_TEXT = "ما هي الرحلات المتاحة من صنعاء إلى عدن؟"
+
+
+def since_process_start() -> float:
+    """Seconds since the worker process started (since this module was imported without psutil)"""
+    try:
+        import psutil
+        return time.time() - psutil.Process().create_time()
+    except ImportError:
+        return time.time() - _IMPORTED_AT
+
+
+class ModelStartup:
+    """
+    Loads the embedding model on a background thread after startup, runs one
+    warm-up encode through the embedding executor and records how long each
+    step took. Requests never load the model themselves: they wait briefly
+    for this (wait_ready) and otherwise answer without retrieved context,
+    and /ready reports the state so a load balancer can hold traffic back.
+
+    A failed load is retried from a background timer, EMBED_LOAD_RETRY_SECONDS
+    after the first failure and doubling up to EMBED_LOAD_RETRY_MAX_SECONDS;
+    until a retry starts, wait_ready returns False at once.
+    """
+
+    def __init__(self):
+        self.status = "not_started"  # loading, ready or failed
+        self.error = None
+        self.attempts = 0
+        self.timings: dict[str, float] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Set on the event loop when the current attempt finishes
+        self._settled: asyncio.Event | None = None
+        self._thread = None
+        self._retry_timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def start(self):
+        """Begin loading (called once on startup, from the event loop)"""
+        with self._lock:
+            if self.status != "not_started":
+                return
+            self._loop = asyncio.get_running_loop()
+            self._settled = asyncio.Event()
+            self._begin_attempt()
+
+    def stop(self):
+        """Cancel a pending retry (called on shutdown)"""
+        with self._lock:
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+                self._retry_timer = None
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for a load in progress without blocking the event loop"""
+        if self.status == "not_started":
+            # Scripts and benchmarks that skip the app startup
+            self.start()
+        if self.status != "loading":
+            return self.ready
+        if timeout > 0:
+            try:
+                await asyncio.wait_for(self._settled.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self.ready
+
+    def _begin_attempt(self):
+        # Called with self._lock held
+        self.attempts += 1
+        self.status = "loading"
+        self._retry_timer = None
+        self._loop.call_soon_threadsafe(self._settled.clear)
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def _retry(self):
+        with self._lock:
+            if self.status == "failed" and self._retry_timer is not None:
+                self._begin_attempt()
+
+    def _run(self):
+        from app.services import rag_service
+
+        started = time.perf_counter()
+        try:
+            rag_service.load_embedding_model()
+            loaded = time.perf_counter()
+            self.timings["model_load_seconds"] = round(loaded - started, 3)
+            if rag_service.embed_model is None:
+                raise ModelException("No embedding model could be loaded")
+
+            embedding_executor.encode([WARMUP_TEXT])
+            self.timings["warmup_seconds"] = round(time.perf_counter() - loaded, 3)
+            self.status = "ready"
+            self.error = None
+        except Exception as e:
+            self.error = str(e)
+            with self._lock:
+                self.status = "failed"
+                delay = min(
+                    settings.EMBED_LOAD_RETRY_SECONDS * 2 ** (self.attempts - 1),
+                    settings.EMBED_LOAD_RETRY_MAX_SECONDS,
+                )
+                self._retry_timer = threading.Timer(delay, self._retry)
+                self._retry_timer.daemon = True
+                self._retry_timer.start()
+            logger.error(f"❌ Embedding model startup failed (attempt {self.attempts}, retrying in {delay:g}s): {e}")
+        finally:
+            self.timings["since_process_start_seconds"] = round(since_process_start(), 3)
+            self._loop.call_soon_threadsafe(self._settled.set)
+
+        if self.ready:
+            logger.info(
+                f"🚀 Cold start: model loaded in {self.timings['model_load_seconds']}s, "
+                f"warm-up encode {self.timings['warmup_seconds']}s, "
+                f"ready {self.timings['since_process_start_seconds']}s after process start"
+            )
+
+    def readiness(self) -> dict:
+        result = {
+            "ready": self.ready, "embedding_model": self.status, "attempts": self.attempts,
+            "timings": dict(self.timings),
+        }
+        if self.error and not self.ready:
+            result["error"] = self.error
+        return result
+
+
+model_startup = ModelStartup()
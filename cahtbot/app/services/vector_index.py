@@ -0,0 +1,173 @@
+import logging
+import math
+import uuid
+from psycopg2 import sql
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_TYPES = ("hnsw", "ivfflat", "none")
+
+# Retrieval orders by `embedding <-> query` (L2 distance)
+VECTOR_OPCLASS = "vector_l2_ops"
+
+# pgvector's build defaults, used when an index has no explicit reloptions
+_DEFAULT_OPTIONS = {"hnsw": {"m": 16, "ef_construction": 64}, "ivfflat": {"lists": 100}}
+
+# pgvector rejects larger hnsw.ef_search values
+HNSW_MAX_EF_SEARCH = 1000
+
+
+def search_settings(k: int | None = None) -> dict[str, str]:
+    """
+    Query-time ANN parameters. Both are set regardless of the index type so a
+    connection stays correct across index rebuilds. HNSW can return at most
+    ef_search rows, so it is raised to k for larger result sets (up to
+    HNSW_MAX_EF_SEARCH).
+    """
+    ef_search = settings.VECTOR_HNSW_EF_SEARCH
+    if k:
+        ef_search = max(ef_search, k)
+    ef_search = min(ef_search, HNSW_MAX_EF_SEARCH)
+    return {"hnsw.ef_search": str(ef_search), "ivfflat.probes": str(settings.VECTOR_IVFFLAT_PROBES)}
+
+
+def search_overrides(k: int) -> dict[str, str]:
+    """The settings a query for k rows needs beyond the connection defaults"""
+    defaults = search_settings()
+    return {name: value for name, value in search_settings(k).items() if defaults[name] != value}
+
+
+def ivfflat_lists(row_count: int) -> int:
+    """VECTOR_IVFFLAT_LISTS, or pgvector's rule of thumb (rows/1000, sqrt(rows) past 1M rows)"""
+    if settings.VECTOR_IVFFLAT_LISTS > 0:
+        return settings.VECTOR_IVFFLAT_LISTS
+    if row_count > 1_000_000:
+        return int(math.sqrt(row_count))
+    return max(row_count // 1000, 1)
+
+
+def desired_index(row_count: int, method: str | None = None) -> tuple[str, dict] | None:
+    """(method, build options) configured in Settings, or None for no ANN index"""
+    method = method or settings.VECTOR_INDEX_TYPE
+    if method not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unknown VECTOR_INDEX_TYPE '{method}', expected one of {VECTOR_INDEX_TYPES}")
+    if method == "hnsw":
+        return method, {"m": settings.VECTOR_HNSW_M, "ef_construction": settings.VECTOR_HNSW_EF_CONSTRUCTION}
+    if method == "ivfflat":
+        return method, {"lists": ivfflat_lists(row_count)}
+    return None
+
+
+def create_index_sql(table: str, name: str, method: str, options: dict) -> sql.Composed:
+    return sql.SQL("CREATE INDEX {name} ON {table} USING {method} (embedding {opclass}) WITH ({options})").format(
+        name=sql.Identifier(name),
+        table=sql.Identifier(table),
+        method=sql.SQL(method),
+        opclass=sql.SQL(VECTOR_OPCLASS),
+        options=sql.SQL(", ").join(sql.SQL(f"{key} = {int(value)}") for key, value in options.items()),
+    )
+
+
+def vector_indexes(cur, table: str) -> list[tuple[str, str, dict]]:
+    """(index name, method, build options) of every ANN index on the table"""
+    cur.execute(
+        """
+        SELECT i.relname, am.amname, i.reloptions
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE x.indrelid = %s::regclass AND am.amname IN ('hnsw', 'ivfflat')
+        """,
+        (table,),
+    )
+    indexes = []
+    for name, method, reloptions in cur.fetchall():
+        options = dict(_DEFAULT_OPTIONS[method])
+        for option in reloptions or []:
+            key, _, value = option.partition("=")
+            options[key] = int(value)
+        indexes.append((name, method, options))
+    return indexes
+
+
+def _matches(method: str, options: dict, wanted: tuple[str, dict]) -> bool:
+    wanted_method, wanted_options = wanted
+    if method != wanted_method:
+        return False
+    if method == "ivfflat" and settings.VECTOR_IVFFLAT_LISTS <= 0:
+        # Auto-sized lists: only rebuild once the table has grown or shrunk a lot
+        return wanted_options["lists"] / 2 <= options["lists"] <= wanted_options["lists"] * 2
+    return options == wanted_options
+
+
+def drop_vector_indexes(conn, table: str):
+    """Remove the ANN indexes of a table, e.g. before a bulk load into it"""
+    cur = conn.cursor()
+    try:
+        for name, _, _ in vector_indexes(cur, table):
+            cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def ensure_vector_index(conn, table: str = "documents_embeddings") -> dict:
+    """
+    Make the table's ANN index match Settings: build it if missing, rebuild it
+    when the type or build options changed, drop it for VECTOR_INDEX_TYPE=none.
+
+    A replacement index is built before the old one is dropped, so searches
+    keep using an index throughout; the build blocks writes, not reads.
+    """
+    cur = conn.cursor()
+    try:
+        cur.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+        row_count = cur.fetchone()[0]
+        wanted = desired_index(row_count)
+        existing = vector_indexes(cur, table)
+
+        keep = next((index for index in existing if wanted and _matches(index[1], index[2], wanted)), None)
+        stale = [index for index in existing if index is not keep]
+
+        status = "unchanged"
+        if wanted and keep is None:
+            method, options = wanted
+            if method == "ivfflat" and row_count == 0:
+                # IVFFlat centroids come from the data; building on an empty table is useless
+                logger.info(f"⏭️ Skipping ivfflat index on empty table {table}")
+                conn.rollback()
+                return {"status": "skipped", "method": method, "options": options, "rows": row_count}
+
+            name = f"idx_embeddings_{method}_{uuid.uuid4().hex[:8]}"
+            cur.execute("SET LOCAL maintenance_work_mem = %s", (settings.VECTOR_INDEX_BUILD_MEMORY,))
+            logger.info(f"🏗️ Building {method} index {name} on {table} ({row_count} rows, {options})")
+            cur.execute(create_index_sql(table, name, method, options))
+            keep = (name, method, options)
+            status = "rebuilt" if stale else "created"
+        elif not wanted and stale:
+            status = "dropped"
+
+        if stale:
+            cur.execute("SET LOCAL lock_timeout = '5s'")
+            for name, _, _ in stale:
+                cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+        conn.commit()
+
+        if status != "unchanged":
+            logger.info(f"✅ Vector index on {table}: {status}")
+        return {
+            "status": status,
+            "index": keep[0] if keep else None,
+            "method": keep[1] if keep else None,
+            "options": keep[2] if keep else None,
+            "rows": row_count,
+        }
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
@@ -1,3 +1,5 @@
+import glob
+import os
 import psycopg2
 from app.config import settings
 
@@ -13,12 +15,35 @@ def run_migration():
             sslmode=settings.DB_SSLMODE,
         )
         cur = conn.cursor()
-        
-        with open("migrations/001_create_history_tables.sql", "r", encoding="utf-8") as f:
-            sql = f.read()
+
+        # Applied files are recorded, so a re-run skips them. Index names in
+        # older files are tied to table names that a shadow re-index swaps, so
+        # re-running them would create duplicate indexes on the renamed tables.
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                filename TEXT PRIMARY KEY,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+        cur.execute("SELECT filename FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+        conn.commit()
+
+        # Applied in file-name order, one transaction per file
+        for path in sorted(glob.glob("migrations/*.sql")):
+            filename = os.path.basename(path)
+            if filename in applied:
+                print(f"  ↷ {path} (already applied)")
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                sql = f.read()
             cur.execute(sql)
+            cur.execute("INSERT INTO schema_migrations (filename) VALUES (%s)", (filename,))
+            conn.commit()
+            print(f"  ✔ {path}")
             
-        conn.commit()
         cur.close()
         conn.close()
         print("✅ Migrations applied successfully!")
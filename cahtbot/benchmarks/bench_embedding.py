@@ -0,0 +1,97 @@
+"""
+Query-embedding latency, throughput and resident memory per backend.
+
+Loads EMBED_MODEL with torch, ONNX fp32 and ONNX int8 (each in a fresh
+process so RSS is not shared), times single-query encodes and a batched
+encode, and compares each ONNX variant's embeddings with torch.
+
+Run from the cahtbot directory after `python export_onnx.py`:
+    python -m benchmarks.bench_embedding
+"""
+import multiprocessing as mp
+import os
+import statistics
+import time
+
+import numpy as np
+import psutil
+
+from app.config import settings
+from app.services.onnx_embedder import PARITY_TEXTS, onnx_model_dir
+
+BACKENDS = [("torch", None), ("onnx fp32", False), ("onnx int8", True)]
+QUERIES = [text for text in PARITY_TEXTS if len(text) < 80]
+REPEATS = 50
+BATCH = 64
+
+
+def _rss_mb() -> float:
+    return psutil.Process(os.getpid()).memory_info().rss / 2**20
+
+
+def _run(backend: str, quantized, results):
+    before = _rss_mb()
+    started = time.perf_counter()
+    if quantized is None:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(settings.EMBED_MODEL_NAME, device="cpu")
+    else:
+        from app.services.onnx_embedder import OnnxEmbedder
+        model = OnnxEmbedder(onnx_model_dir(), quantized=quantized)
+    load_seconds = time.perf_counter() - started
+    model.encode(QUERIES[0])  # warm-up
+
+    samples = []
+    for i in range(REPEATS):
+        query = QUERIES[i % len(QUERIES)]
+        started = time.perf_counter()
+        model.encode(query)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+
+    texts = (PARITY_TEXTS * (BATCH // len(PARITY_TEXTS) + 1))[:BATCH]
+    started = time.perf_counter()
+    model.encode(texts, batch_size=BATCH)
+    batch_seconds = time.perf_counter() - started
+
+    results.put({
+        "backend": backend,
+        "load_s": load_seconds,
+        "p50_ms": statistics.median(samples),
+        "p95_ms": samples[int(len(samples) * 0.95) - 1],
+        "batch_per_s": BATCH / batch_seconds,
+        "rss_mb": _rss_mb() - before,
+        "embeddings": np.asarray(model.encode(PARITY_TEXTS), dtype=np.float32),
+    })
+
+
+def main():
+    ctx = mp.get_context("spawn")
+    rows = []
+    for backend, quantized in BACKENDS:
+        results = ctx.Queue()
+        process = ctx.Process(target=_run, args=(backend, quantized, results))
+        process.start()
+        try:
+            rows.append(results.get(timeout=600))
+        except Exception as e:
+            print(f"⚠️ {backend} skipped: {e}")
+        process.join()
+
+    reference = next((row["embeddings"] for row in rows if row["backend"] == "torch"), None)
+    print(f"{'backend':>10} | {'load (s)':>8} | {'p50 (ms)':>8} | {'p95 (ms)':>8} | {'batch/s':>8} | {'RSS (MiB)':>9} | {'cosine vs torch':>15}")
+    print("-" * 86)
+    for row in rows:
+        parity = "-"
+        if reference is not None and row["backend"] != "torch":
+            a, b = reference, row["embeddings"]
+            cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+            parity = f"{cosine.mean():.4f} (min {cosine.min():.4f})"
+        print(
+            f"{row['backend']:>10} | {row['load_s']:>8.2f} | {row['p50_ms']:>8.2f} | {row['p95_ms']:>8.2f} | "
+            f"{row['batch_per_s']:>8.1f} | {row['rss_mb']:>9.0f} | {parity:>15}"
+        )
+
+
+if __name__ == "__main__":
+    main()
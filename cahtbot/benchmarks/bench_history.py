@@ -0,0 +1,73 @@
+"""
+Per-turn history fetch cost as a conversation grows.
+
+Creates a throw-away conversation, grows it to each size in SIZES and times
+HistoryService.get_conversation_with_history_async (SQL-side LIMIT) against the old
+fetch-everything-and-slice query. The conversation is deleted afterwards.
+
+Run from the cahtbot directory (after `python apply_migrations.py`):
+    python -m benchmarks.bench_history
+"""
+import asyncio
+import statistics
+import time
+import uuid
+
+from app.database import get_async_pool, close_async_pool
+from app.services.history_service import history_service
+
+SIZES = [10, 100, 1000, 5000]
+REPEATS = 30
+LIMIT = 10
+
+
+async def _timed(coro_factory) -> float:
+    samples = []
+    for _ in range(REPEATS):
+        started = time.perf_counter()
+        await coro_factory()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+async def main():
+    pool = await get_async_pool()
+    conversation_id = str(uuid.uuid4())
+    user_id = f"bench_{conversation_id[:8]}"
+    await pool.execute("INSERT INTO conversations (id, user_id) VALUES ($1, $2)", conversation_id, user_id)
+
+    async def fetch_all_and_slice():
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT role, content FROM messages WHERE conversation_id = $1 ORDER BY created_at ASC",
+                conversation_id,
+            )
+        return rows[-LIMIT:]
+
+    print(f"{'messages':>10} | {'LIMIT in SQL (ms)':>18} | {'fetch all (ms)':>15}")
+    print("-" * 50)
+    try:
+        current = 0
+        for size in SIZES:
+            await pool.execute(
+                """
+                INSERT INTO messages (conversation_id, role, content, created_at)
+                SELECT $1, CASE WHEN i % 2 = 0 THEN 'user' ELSE 'assistant' END,
+                       repeat('رسالة تجريبية ', 20), NOW() + i * INTERVAL '1 millisecond'
+                FROM generate_series($2::int, $3::int - 1) AS i
+                """,
+                conversation_id, current, size,
+            )
+            current = size
+            await pool.execute("ANALYZE messages")
+
+            limited = await _timed(lambda: history_service.get_conversation_with_history_async(user_id, limit=LIMIT))
+            full = await _timed(fetch_all_and_slice)
+            print(f"{size:>10} | {limited:>18.2f} | {full:>15.2f}")
+    finally:
+        await pool.execute("DELETE FROM conversations WHERE id = $1", conversation_id)
+        await close_async_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+"""
+Query-embedding throughput under bursts, with and without micro-batching.
+
+Sends CONCURRENCY distinct queries at once through the embedding executor
+(bypassing query_embedding_cache) with EMBED_MICROBATCH_MAX_SIZE=1 and with
+the configured settings, and reports queries/sec and per-query latency.
+A lone query is timed as well to show the cost of the wait window.
+
+Run from the cahtbot directory:
+    python -m benchmarks.bench_microbatch
+"""
+import asyncio
+import statistics
+import time
+
+from app.config import settings
+from app.services.embedding_executor import embedding_executor
+from app.services.rag_service import get_embedding_model
+
+BURSTS = [1, 8, 32, 64]
+ROUNDS = 5
+
+
+async def _timed_query(text: str) -> float:
+    started = time.perf_counter()
+    await embedding_executor.encode_async([text])
+    return (time.perf_counter() - started) * 1000
+
+
+async def _burst(size: int, round_no: int) -> tuple[float, list[float]]:
+    texts = [f"ما هي الرحلات المتاحة رقم {round_no}-{i} من صنعاء إلى عدن؟" for i in range(size)]
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[_timed_query(text) for text in texts])
+    return time.perf_counter() - started, latencies
+
+
+async def _run(label: str, max_size: int):
+    settings.EMBED_MICROBATCH_MAX_SIZE = max_size
+    for size in BURSTS:
+        elapsed, latencies = 0.0, []
+        for round_no in range(ROUNDS):
+            seconds, round_latencies = await _burst(size, round_no)
+            elapsed += seconds
+            latencies.extend(round_latencies)
+        print(
+            f"{label:>12} | {size:>5} | {size * ROUNDS / elapsed:>10.1f} | "
+            f"{statistics.median(latencies):>8.1f} | {max(latencies):>8.1f}"
+        )
+
+
+async def main():
+    configured = settings.EMBED_MICROBATCH_MAX_SIZE
+    get_embedding_model()
+    await embedding_executor.encode_async(["warm-up"])
+
+    print(f"wait window {settings.EMBED_MICROBATCH_MAX_WAIT_MS} ms, max batch {configured}")
+    print(f"{'mode':>12} | {'burst':>5} | {'queries/s':>10} | {'p50 (ms)':>8} | {'max (ms)':>8}")
+    print("-" * 56)
+    await _run("unbatched", 1)
+    await _run("micro-batch", configured)
+    embedding_executor.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Recall vs. latency of pgvector ANN indexes on the current embeddings.
+
+Copies documents_embeddings into a scratch table, takes QUERIES stored
+vectors as queries and computes their exact top-K neighbours with NumPy.
+It then builds each index type with the build options from Settings and
+sweeps the query-time knob (hnsw.ef_search / ivfflat.probes), reporting
+recall@K and median/p95 latency next to the exact sequential scan.
+The scratch table is dropped afterwards; live indexes are not touched.
+
+Run from the cahtbot directory:
+    python -m benchmarks.bench_vector_index
+"""
+import json
+import random
+import statistics
+import time
+
+import numpy as np
+from psycopg2 import sql
+
+from app.database import get_connection, return_connection, format_vector
+from app.services.vector_index import create_index_sql, desired_index
+
+SCRATCH_TABLE = "bench_vector_index"
+QUERIES = 200
+K = 5
+EF_SEARCH_VALUES = [10, 20, 40, 80, 160]
+PROBES_VALUES = [1, 5, 10, 20, 50]
+
+
+def _search(cur, query: str, k: int) -> list[int]:
+    cur.execute(
+        sql.SQL("SELECT id FROM {} ORDER BY embedding <-> %s::vector LIMIT %s").format(sql.Identifier(SCRATCH_TABLE)),
+        (query, k),
+    )
+    return [row[0] for row in cur.fetchall()]
+
+
+def _measure(cur, queries: list[str], truth: list[set[int]]) -> tuple[float, float, float]:
+    """(recall@K, median ms, p95 ms) over all queries with the current settings"""
+    latencies = []
+    found = 0
+    for query, expected in zip(queries, truth):
+        started = time.perf_counter()
+        ids = _search(cur, query, K)
+        latencies.append((time.perf_counter() - started) * 1000)
+        found += len(expected.intersection(ids))
+    latencies.sort()
+    return found / (K * len(queries)), statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def _report(label: str, recall: float, median: float, p95: float):
+    print(f"{label:>24} | {recall:>9.3f} | {median:>11.2f} | {p95:>8.2f}")
+
+
+def main():
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+    try:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(SCRATCH_TABLE)))
+        cur.execute(
+            sql.SQL("""
+                CREATE TABLE {} AS
+                SELECT row_number() OVER () AS id, embedding FROM documents_embeddings
+            """).format(sql.Identifier(SCRATCH_TABLE))
+        )
+        cur.execute(sql.SQL("SELECT id, embedding::text FROM {} ORDER BY id").format(sql.Identifier(SCRATCH_TABLE)))
+        rows = cur.fetchall()
+        if len(rows) < K:
+            print(f"Need at least {K} embeddings, found {len(rows)}; run build_embeddings.py first")
+            return
+
+        ids = np.array([row[0] for row in rows])
+        matrix = np.array([json.loads(row[1]) for row in rows], dtype=np.float32)
+        sample = random.Random(42).sample(range(len(rows)), min(QUERIES, len(rows)))
+        queries = [format_vector(matrix[i]) for i in sample]
+
+        # Exact neighbours by L2 distance (the `<->` operator)
+        truth = []
+        for i in sample:
+            distances = np.linalg.norm(matrix - matrix[i], axis=1)
+            truth.append(set(ids[np.argsort(distances)[:K]].tolist()))
+
+        print(f"{len(rows)} vectors, {len(queries)} queries, recall@{K}\n")
+        print(f"{'configuration':>24} | {'recall':>9} | {'median (ms)':>11} | {'p95 (ms)':>8}")
+        print("-" * 62)
+        cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(SCRATCH_TABLE)))
+        _report("exact scan", *_measure(cur, queries, truth))
+
+        for method, knob, values in (
+            ("hnsw", "hnsw.ef_search", EF_SEARCH_VALUES),
+            ("ivfflat", "ivfflat.probes", PROBES_VALUES),
+        ):
+            _, options = desired_index(len(rows), method)
+            name = f"{SCRATCH_TABLE}_{method}"
+            started = time.perf_counter()
+            cur.execute(create_index_sql(SCRATCH_TABLE, name, method, options))
+            cur.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(SCRATCH_TABLE)))
+            print(f"-- {method} {options}, built in {time.perf_counter() - started:.1f}s")
+            # Small tables would otherwise be planned as a sequential scan
+            cur.execute("SET enable_seqscan = off")
+            for value in values:
+                cur.execute("SELECT set_config(%s, %s, false)", (knob, str(value)))
+                _report(f"{knob}={value}", *_measure(cur, queries, truth))
+            cur.execute("RESET enable_seqscan")
+            cur.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+    finally:
+        cur.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(SCRATCH_TABLE)))
+        cur.close()
+        conn.autocommit = False
+        return_connection(conn)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import os
+import sys
+import time
 import psycopg2
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
@@ -20,6 +22,11 @@ DB_SSLMODE = os.getenv("NEON_DB_SSLMODE", "require")
 EMBED_MODEL_NAME = os.getenv(
     "EMBED_MODEL", "Omartificial-Intelligence-Space/arabic-matryoshka-embed-base"
 )
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "1"))
+
+# --incremental: لا يحذف الجدول، ويعيد توليد المتجهات للنصوص الجديدة أو المعدلة فقط
+INCREMENTAL = "--incremental" in sys.argv
 
 print(f"\n📦 Loading embedding model: {EMBED_MODEL_NAME}")
 try:
@@ -47,11 +54,30 @@ def clear_embeddings():
         deleted_count = cur.rowcount
         conn.commit()
         cur.close()
+        # فهرس ANN يُبنى مرة واحدة بعد التحميل بدلاً من تحديثه مع كل صف
+        from app.services.vector_index import drop_vector_indexes
+        drop_vector_indexes(conn, "documents_embeddings")
         return_connection(conn)
         print(f"✅ Deleted {deleted_count} old embeddings")
     except Exception as e:
         print(f"❌ Error clearing embeddings: {e}")
 
+def build_vector_index():
+    """
+    ينشئ فهرس ANN (HNSW أو IVFFlat) حسب الإعدادات، أو يعيد بناءه إذا تغيرت
+    """
+    from app.services.vector_index import ensure_vector_index
+
+    print("\n🏗️  Checking vector index...")
+    conn = get_connection()
+    try:
+        result = ensure_vector_index(conn)
+        print(f"✅ Vector index {result['status']}: {result.get('index') or '-'} ({result['method']}, {result['options']})")
+    except Exception as e:
+        print(f"❌ Error building vector index: {e}")
+    finally:
+        return_connection(conn)
+
 def fetch_trips_with_stops():
     """
     يجلب كل رحلة مع نقاط الصعود التابعة لها
@@ -100,7 +126,8 @@ def fetch_trips_with_stops():
         print(f"✅ Found {len(rows)} scheduled trips")
     except Exception as e:
         print(f"❌ Error fetching trips: {e}")
-        rows = []
+        # None وليس [] حتى لا يحذف الوضع التزايدي صفوف المصدر كلها عند فشل الجلب
+        rows = None
     cur.close()
     return_connection(conn)
     return rows
@@ -147,7 +174,8 @@ def fetch_routes():
         print(f"✅ Found {len(rows)} routes")
     except Exception as e:
         print(f"❌ Error fetching routes: {e}")
-        rows = []
+        # None وليس [] حتى لا يحذف الوضع التزايدي صفوف المصدر كلها عند فشل الجلب
+        rows = None
     cur.close()
     return_connection(conn)
     return rows
@@ -175,38 +203,59 @@ def fetch_cancel_policies():
         print(f"✅ Found {len(rows)} cancellation policies")
     except Exception as e:
         print(f"❌ Error fetching policies: {e}")
-        rows = []
+        # None وليس [] حتى لا يحذف الوضع التزايدي صفوف المصدر كلها عند فشل الجلب
+        rows = None
     cur.close()
     return_connection(conn)
     return rows
 
-def insert_embedding(source_table, source_id, text_chunk, embedding):
+def index_chunks(source_table, items):
+    """
+    يحوّل النصوص إلى متجهات على دفعات ثم يخزنها بكتابة جماعية (COPY)
+    items: قائمة من (source_id, text_chunk, filters) حيث filters = (مدينة الانطلاق، مدينة الوصول، تاريخ المغادرة)
+    """
+    from app.services.rag_service import encode_batch
+    from app.services.embedding_store import bulk_insert_embeddings, sync_source_embeddings, content_hash
+
+    def encode(texts):
+        return encode_batch(texts, model=embed_model, batch_size=EMBED_BATCH_SIZE, workers=EMBED_WORKERS)
+
+    if not items and not INCREMENTAL:
+        return 0
+
+    started = time.perf_counter()
+    conn = get_connection()
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        embedding_str = "[" + ",".join(str(float(x)) for x in embedding) + "]"
-        cur.execute(
-            """
-            INSERT INTO documents_embeddings (source_table, source_id, text_chunk, embedding)
-            VALUES (%s, %s, %s, %s::vector)
-            ON CONFLICT DO NOTHING;
-            """,
-            (source_table, source_id, text_chunk, embedding_str),
-        )
-        conn.commit()
-        cur.close()
+        if INCREMENTAL:
+            result = sync_source_embeddings(conn, source_table, items, encode)
+            print(f"  🔁 {result['unchanged']} unchanged, {result['replaced']} replaced, {result['deleted']} removed")
+        else:
+            embeddings = encode([text_chunk for _, text_chunk, _ in items])
+            result = bulk_insert_embeddings(
+                conn,
+                [(source_table, source_id, text_chunk, content_hash(text_chunk), *filters, emb)
+                 for (source_id, text_chunk, filters), emb in zip(items, embeddings)],
+            )
+    finally:
         return_connection(conn)
-        return True
-    except Exception as e:
-        print(f"  ❌ Error inserting embedding for {source_table}#{source_id}: {e}")
-        return False
+
+    elapsed = time.perf_counter() - started
+    print(f"  ⚡ Processed {len(items)} {source_table} in {elapsed:.1f}s ({len(items) / elapsed if elapsed else 0:.1f} rows/sec)")
+
+    for error in result["errors"]:
+        print(f"  ❌ Batch {error['batch']} of {source_table} failed ({error['rows']} rows, ids {error['source_ids']}...): {error['error']}")
+    return result["inserted"] + result.get("unchanged", 0)
 
 def index_trips():
+    from app.services.embedding_store import filter_values
+
     rows = fetch_trips_with_stops()
+    if rows is None:
+        return 0
     print(f"\n🔄 Indexing {len(rows)} trips...")
-    success_count = 0
+    items = []
     
-    for idx, row in enumerate(rows, 1):
+    for row in rows:
         (
             trip_id,
             origin_city,
@@ -226,22 +275,21 @@ def index_trips():
             f"حالة الرحلة: {status}.\n"
             f"نقاط الصعود المتاحة: {boarding_points or 'لا توجد نقاط صعود إضافية'}."
         )
-
-        emb = embed_model.encode(text_chunk)
-        if insert_embedding("trips", trip_id, text_chunk, emb):
-            success_count += 1
-        
-        if idx % 10 == 0:
-            print(f"  Progress: {idx}/{len(rows)} trips indexed")
+        items.append((trip_id, text_chunk, filter_values(origin_city, destination_city, departure_time)))
     
+    success_count = index_chunks("trips", items)
     print(f"✅ Successfully indexed {success_count}/{len(rows)} trips")
 
 def index_routes():
+    from app.services.embedding_store import filter_values
+
     rows = fetch_routes()
+    if rows is None:
+        return 0
     print(f"\n🔄 Indexing {len(rows)} routes...")
-    success_count = 0
+    items = []
     
-    for idx, row in enumerate(rows, 1):
+    for row in rows:
         (
             route_id,
             origin_city,
@@ -258,17 +306,19 @@ def index_routes():
             f"المسافة: {distance_km or 'غير محدد'} كم.\n"
             f"نقاط التوقف على المسار: {route_stops}"
         )
-
-        emb = embed_model.encode(text_chunk)
-        if insert_embedding("routes", route_id, text_chunk, emb):
-            success_count += 1
+        items.append((route_id, text_chunk, filter_values(origin_city, destination_city)))
     
+    success_count = index_chunks("routes", items)
     print(f"✅ Successfully indexed {success_count}/{len(rows)} routes")
 
 def index_policies():
+    from app.services.embedding_store import NO_FILTERS
+
     rows = fetch_cancel_policies()
+    if rows is None:
+        return 0
     print(f"\n🔄 Indexing {len(rows)} cancellation policies...")
-    success_count = 0
+    items = []
     
     for row in rows:
         policy_id, policy_name, description, refund_percentage, days_before, company_name = row
@@ -279,10 +329,9 @@ def index_policies():
             f"نسبة الاسترجاع: {refund_percentage}%.\\n"
             f"يجب الإلغاء قبل {days_before} يوم من موعد الرحلة."
         )
-        emb = embed_model.encode(text_chunk)
-        if insert_embedding("cancel_policies", policy_id, text_chunk, emb):
-            success_count += 1
+        items.append((policy_id, text_chunk, NO_FILTERS))
     
+    success_count = index_chunks("cancel_policies", items)
     print(f"✅ Successfully indexed {success_count}/{len(rows)} policies")
 
 def fetch_active_faqs():
@@ -307,15 +356,20 @@ def fetch_active_faqs():
         print(f"✅ Found {len(rows)} active FAQs")
     except Exception as e:
         print(f"❌ Error fetching FAQs: {e}")
-        rows = []
+        # None وليس [] حتى لا يحذف الوضع التزايدي صفوف المصدر كلها عند فشل الجلب
+        rows = None
     cur.close()
     return_connection(conn)
     return rows
 
 def index_faqs():
+    from app.services.embedding_store import NO_FILTERS
+
     rows = fetch_active_faqs()
+    if rows is None:
+        return 0
     print(f"\n🔄 Indexing {len(rows)} FAQs...")
-    success_count = 0
+    items = []
     
     for row in rows:
         faq_id, category, question, answer = row
@@ -326,19 +380,22 @@ def index_faqs():
         )
         
         # نستخدم السؤال + الإجابة لتوليد التضمين لضمان دقة البحث
-        emb = embed_model.encode(text_chunk)
-        if insert_embedding("faqs", faq_id, text_chunk, emb):
-            success_count += 1
+        items.append((faq_id, text_chunk, NO_FILTERS))
             
+    success_count = index_chunks("faqs", items)
     print(f"✅ Successfully indexed {success_count}/{len(rows)} FAQs")
 
 def main():
     try:
-        clear_embeddings()
+        if INCREMENTAL:
+            print("\n🔁 Incremental mode: only new or changed rows will be embedded")
+        else:
+            clear_embeddings()
         index_trips()
         index_routes()
         index_policies()
         index_faqs()
+        build_vector_index()
         print("\n" + "=" * 60)
         print("✅ Indexing completed successfully!")
         print("=" * 60)
@@ -0,0 +1,30 @@
+"""
+Download a pinned snapshot of the embedding model into EMBED_MODEL_DIR so
+workers start from local files without contacting the Hugging Face hub.
+
+    python download_model.py                # EMBED_MODEL at EMBED_MODEL_REVISION (or latest)
+    python download_model.py <model name>   # e.g. the model used by build_embeddings.py
+
+Set EMBED_MODEL_REVISION to the printed commit to pin later downloads, and
+EMBED_MODEL_OFFLINE=true to make a missing snapshot an error instead of a
+hub download at startup.
+"""
+import sys
+from huggingface_hub import HfApi, snapshot_download
+from app.config import settings
+from app.services.rag_service import model_snapshot_dir
+
+
+def main():
+    model_name = sys.argv[1] if len(sys.argv) > 1 else settings.EMBED_MODEL_NAME
+    revision = settings.EMBED_MODEL_REVISION
+    commit = HfApi().model_info(model_name, revision=revision).sha
+    target = model_snapshot_dir(model_name)
+
+    print(f"📦 Downloading {model_name}@{commit} -> {target}")
+    snapshot_download(repo_id=model_name, revision=commit, local_dir=target, local_dir_use_symlinks=False)
+    print(f"✅ Snapshot ready; pin it with EMBED_MODEL_REVISION={commit}")
+
+
+if __name__ == "__main__":
+    main()
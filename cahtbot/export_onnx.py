@@ -0,0 +1,44 @@
+"""
+Export the embedding model to ONNX for EMBED_BACKEND=onnx.
+
+    python export_onnx.py                   # EMBED_MODEL -> EMBED_ONNX_DIR/<model>
+    python export_onnx.py <model name>      # e.g. the model used by build_embeddings.py
+    python export_onnx.py --no-quantize     # fp32 only (serve with EMBED_ONNX_QUANTIZE=false)
+
+The export is checked against the torch embeddings; a mean cosine below
+MIN_COSINE means the ONNX model would not match vectors already stored in
+documents_embeddings, and the script exits with an error.
+"""
+import sys
+from app.config import settings
+from app.services.onnx_embedder import export_onnx, onnx_model_dir
+
+MIN_COSINE = 0.99
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    quantize = "--no-quantize" not in sys.argv
+    model_name = args[0] if args else settings.EMBED_MODEL_NAME
+    output_dir = onnx_model_dir(model_name)
+
+    print(f"📦 Exporting {model_name} -> {output_dir} (int8: {quantize})")
+    result = export_onnx(model_name, output_dir, quantize=quantize)
+
+    ok = True
+    for variant in ("fp32", "int8"):
+        if variant not in result:
+            continue
+        check = result[variant]
+        passed = check["mean_cosine"] >= MIN_COSINE
+        ok = ok and passed
+        print(f"  {'✅' if passed else '❌'} {variant}: mean cosine {check['mean_cosine']}, min {check['min_cosine']} vs torch")
+
+    if not ok:
+        print(f"❌ Parity check failed (mean cosine < {MIN_COSINE})")
+        sys.exit(1)
+    print("✅ Export complete; set EMBED_BACKEND=onnx to serve it")
+
+
+if __name__ == "__main__":
+    main()
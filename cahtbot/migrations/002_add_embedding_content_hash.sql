@@ -0,0 +1,5 @@
+-- Content hash per embedded chunk, used by incremental re-indexing
+ALTER TABLE documents_embeddings ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+CREATE INDEX IF NOT EXISTS idx_documents_embeddings_source
+    ON documents_embeddings(source_table, source_id);
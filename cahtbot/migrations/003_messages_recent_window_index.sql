@@ -0,0 +1,6 @@
+-- Recent-window history lookups: WHERE conversation_id = ? ORDER BY created_at DESC LIMIT n
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_created
+    ON messages(conversation_id, created_at DESC);
+
+-- The composite index serves every lookup the single-column one did
+DROP INDEX IF EXISTS idx_messages_conversation_id;
@@ -0,0 +1,30 @@
+-- Hybrid retrieval: lexical search over text_chunk and structured prefilters
+-- next to the embedding. Applied to the previous generation as well so a
+-- rollback keeps working. Run a shadow or full re-index afterwards to fill
+-- the new columns (incremental mode skips rows whose text did not change).
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+DO $$
+DECLARE
+    t TEXT;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['documents_embeddings', 'documents_embeddings_previous'] LOOP
+        IF to_regclass(t) IS NOT NULL THEN
+            EXECUTE format(
+                'ALTER TABLE %I
+                    ADD COLUMN IF NOT EXISTS origin_city TEXT,
+                    ADD COLUMN IF NOT EXISTS destination_city TEXT,
+                    ADD COLUMN IF NOT EXISTS departure_date DATE,
+                    ADD COLUMN IF NOT EXISTS text_search TSVECTOR
+                        GENERATED ALWAYS AS (to_tsvector(''simple'', coalesce(text_chunk, ''''))) STORED',
+                t
+            );
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING gin (text_search)', 'idx_' || t || '_text_search', t);
+            EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I USING gin (text_chunk gin_trgm_ops)', 'idx_' || t || '_text_trgm', t);
+            EXECUTE format(
+                'CREATE INDEX IF NOT EXISTS %I ON %I (origin_city, destination_city, departure_date)',
+                'idx_' || t || '_filters', t
+            );
+        END IF;
+    END LOOP;
+END $$;
@@ -198,6 +198,79 @@ async function sendMessageToAPI(message) {
     }
 }
 
+/**
+ * إرسال رسالة إلى API مع استقبال الإجابة تدريجياً (Server-Sent Events)
+ * يتم استدعاء onToken مع النص المتجمع بعد كل جزء يصل
+ */
+async function streamMessageFromAPI(message, onToken) {
+    const response = await fetch(`${API_URL}/chat/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+            'Accept': 'text/event-stream',
+        },
+        body: JSON.stringify({
+            message: message,
+            max_results: 5
+        })
+    });
+
+    if (!response.ok || !response.body) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+    }
+
+    // من هنا قبل الخادم الدور وسيحفظ السؤال حتى لو انقطع البث،
+    // لذلك يُعلَّم أي خطأ بعد هذه النقطة حتى لا نعيد إرساله إلى /chat
+    try {
+        return await readAnswerStream(response, onToken);
+    } catch (error) {
+        error.turnAccepted = true;
+        throw error;
+    }
+}
+
+/**
+ * قراءة أحداث البث وتجميع الإجابة
+ */
+async function readAnswerStream(response, onToken) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+    let answer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // كل حدث ينتهي بسطر فارغ
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (!data) continue;
+
+            const payload = JSON.parse(data);
+            if (eventName === 'error') {
+                throw new Error(payload.detail || 'stream error');
+            }
+            if (eventName === 'done') {
+                return answer;
+            }
+            answer += payload.token || '';
+            onToken(answer);
+        }
+    }
+    return answer;
+}
+
 /**
  * معالجة إرسال الرسالة
  */
@@ -219,21 +292,35 @@ async function handleSendMessage(message) {
     setFormDisabled(true);
     showTypingIndicator();
 
+    let botBubble = null;
     try {
-        // إرسال الرسالة إلى API
-        const response = await sendMessageToAPI(message);
-        
-        // إخفاء مؤشر الكتابة
-        hideTypingIndicator();
-        
-        // إضافة رد البوت
-        addMessage(response, false);
-    } catch (error) {
-        // إخفاء مؤشر الكتابة
+        // إرسال الرسالة إلى API وعرض الإجابة أثناء وصولها
+        await streamMessageFromAPI(message, (text) => {
+            if (!botBubble) {
+                hideTypingIndicator();
+                const messageElement = createMessageElement('', false);
+                chatMessages.appendChild(messageElement);
+                botBubble = messageElement.querySelector('.message-bubble');
+            }
+            botBubble.innerHTML = formatMessage(text);
+            scrollToBottom();
+        });
         hideTypingIndicator();
-        
-        // إظهار رسالة خطأ
-        showError('عذراً، حدث خطأ في الاتصال. يرجى المحاولة مرة أخرى.');
+    } catch (streamError) {
+        console.error('Streaming failed:', streamError);
+        try {
+            // نعود للطلب العادي فقط إذا لم يقبل الخادم الدور (وإلا لحُفظ السؤال مرتين)
+            if (botBubble || streamError.turnAccepted) throw streamError;
+            const response = await sendMessageToAPI(message);
+            hideTypingIndicator();
+            addMessage(response, false);
+        } catch (error) {
+            // إخفاء مؤشر الكتابة
+            hideTypingIndicator();
+            
+            // إظهار رسالة خطأ
+            showError('عذراً، حدث خطأ في الاتصال. يرجى المحاولة مرة أخرى.');
+        }
     } finally {
         // تفعيل النموذج مرة أخرى
         setFormDisabled(false);